@@ -19,125 +19,162 @@ from helpers.polarization_helpers import *
 from helpers.render_helpers import *
 from helpers.math_helpers import *
 from helpers.sys_helpers import *
+from helpers.cache_helpers import RenderCache
+from helpers.queue_helpers import LeaseQueue
+from helpers.backend_helpers import BackendConfig
+from helpers.asset_helpers import AssetCache
+from helpers.camera_helpers import CameraRig, camera_angles
 
 
-def render_masks(scene, radius, thetas, phis):
-	params = mi.traverse(scene)
+def dataset_paths(output_path, angles=(0, 90)):
+	mask_path = os.path.join(output_path, "masks")
+	unpolarized_path = os.path.join(output_path, "unpolarized", "images")
+	polarized_paths = [os.path.join(output_path, f"polarized_{angle:g}", "images") for angle in angles]
 
-	# Save old transforms
-	polarizer_light_transform = mi.Transform4f(params["polarizer_light.to_world"])
-	polarizer_cam_transform = mi.Transform4f(params["polarizer_cam.to_world"])
+	return mask_path, unpolarized_path, polarized_paths
 
-	# Move polarizers away
-	params["polarizer_light.to_world"] = mi.Transform4f().translate([0, 10000, 0])
-	params["polarizer_cam.to_world"] = mi.Transform4f().translate([0, 10000, 0])
-	params.update()
+def existing_train_cams(output_path, rig):
+	# Number of train views of an existing dataset that was rendered with the same camera sequence
+	poses_path = os.path.join(output_path, "poses.json")
 
-	# Calculate maximum distance of vertices to camera
-	head_positions = np.array(params["head.vertex_positions"]).reshape(3, -1)
-	hair_positions = np.array(params["hair.control_points"]).reshape(4, -1)[:3, :]
+	if not os.path.exists(poses_path):
+		return 0
 
-	head_dist = np.linalg.norm(head_positions, ord=2, axis=0)
-	hair_dist = np.linalg.norm(hair_positions, ord=2, axis=0)
+	with open(poses_path, "r") as f:
+		poses = json.load(f)
 
-	threshold = radius + max(head_dist.max(), hair_dist.max())
+	if poses.get("camera_sequence") != rig.camera_sequence or poses.get("radius") != rig.radius:
+		return 0
 
-	integrator = mi.load_dict({
-		"type": "depth"
-	})
+	train_cams = sum(not camera["is_test_cam"] for camera in poses["cameras"])
 
-	images = render_from_angles(scene, radius, thetas, phis, polarized=False, integrator=integrator)
-	images = np.average(images, axis=-1) # convert to grayscale
+	if train_cams < rig.num_train_cams:
+		# Growing keeps the existing images, so they must have been rendered with the same resolution and field of view
+		intrinsics = rig.poses()["cameras"][0]["intrinsics"]
 
-	masks = np.where(images > threshold, 0.0, 1.0)
+		for camera in poses["cameras"]:
+			same_intrinsics = camera["intrinsics"]["resolution"] == intrinsics["resolution"] and np.allclose(camera["intrinsics"]["camera_matrix"], intrinsics["camera_matrix"])
+			assert same_intrinsics, f"The dataset in {output_path} was rendered with other intrinsics (resolution {camera['intrinsics']['resolution']}), it can't be grown"
 
-	# Undo changes to scenes
-	params["polarizer_light.to_world"] = polarizer_light_transform
-	params["polarizer_cam.to_world"] = polarizer_cam_transform
-	params.update()
+	return train_cams
 
-	return masks
+def grow_dataset(output_path, old_train_cams, new_train_cams, num_test_cams, angles=(0, 90), extension=".png"):
+	# Test views are stored after the train views, so they are moved to their new indices.
+	# Moving backwards makes sure that no test view is overwritten if the old and new ranges overlap.
+	mask_path, unpolarized_path, polarized_paths = dataset_paths(output_path, angles)
+	paths = [(mask_path, ".png.png"), (unpolarized_path, extension)] + [(path, extension) for path in polarized_paths]
 
-def render_unpolarized_images(scene, radius, thetas, phis, spp):
-	params = mi.traverse(scene)
+	for i in reversed(range(num_test_cams)):
+		for path, extension in paths:
+			old_file = os.path.join(path, str(old_train_cams + i).zfill(4) + extension)
+			new_file = os.path.join(path, str(new_train_cams + i).zfill(4) + extension)
 
-	# Save old transforms
-	polarizer_cam_transform = mi.Transform4f(params["polarizer_cam.to_world"])
+			if os.path.exists(old_file):
+				os.replace(old_file, new_file)
 
-	# Move polarizers away
-	params["polarizer_cam.to_world"] = mi.Transform4f().translate([0, 10000, 0])
-	params.update()
+	# Only the new train views have to be rendered
+	return list(range(old_train_cams, new_train_cams))
 
-	images = render_from_angles(scene, radius, thetas, phis, polarized=False, spp=spp)
-	
-	# Undo changes to scenes
-	params["polarizer_cam.to_world"] = polarizer_cam_transform
-	params.update()
+def render_dataset(polarized_scene, unpolarized_scene, output_path, radius, thetas, phis, spp, white_background=False, max_pending=8, angles=(0, 90), stokes=False, mask_spp=1, polarized_cache=None, unpolarized_cache=None, work_queue=None, indices=None, sampler=None, crop_to_mask=False, extension=".png", batch_size=1):
+	# Renders, masks and writes one view at a time, so memory usage does not depend on the number of cameras
+	mask_path, unpolarized_path, polarized_paths = dataset_paths(output_path, angles)
 
-	return images
+	for path in [mask_path, unpolarized_path] + polarized_paths:
+		os.makedirs(path, exist_ok=True)
 
-def render_polarized_images(scene, radius, thetas, phis, spp):
-	return render_from_angles(scene, radius, thetas, phis, polarized=True, spp=spp)
+	if type(indices) == type(None):
+		indices = list(range(len(thetas)))
 
-def mask_images(images, masks, white_background=False):
-	if white_background:
-		return images * masks[..., None] + (1 - masks[..., None])
+	if type(work_queue) == type(None):
+		# Masks are ray cast in batches of views, which is much cheaper than rendering them
+		views = zip(indices, iter_ray_cast_masks(polarized_scene, radius, thetas[indices], phis[indices], shape_ids=("head", "hair"), spp=mask_spp))
+		total = len(indices)
 	else:
-		return images * masks[..., None]
+		# Other workers render the remaining views, so only the claimed ones are ray cast
+		views = ((i, ray_cast_masks(polarized_scene, radius, thetas[i:i + 1], phis[i:i + 1], shape_ids=("head", "hair"), spp=mask_spp)[0]) for i in work_queue.claims(len(thetas)))
+		total = len(work_queue.remaining(len(thetas)))
+
+	# With Stokes rendering, all polarizer angles are computed from a single render
+	polarized_integrator = stokes_integrator(polarized_scene) if stokes else None
+
+	unpolarized_batches, polarized_batches = None, None
+
+	if batch_size != 1:
+		# Several views are rendered per launch and written one by one, which needs all views to be known upfront
+		assert type(work_queue) == type(None) and type(sampler) == type(None) and not crop_to_mask, "--batch_size can't be combined with --worker, --adaptive or --crop"
+		assert type(polarized_cache) == type(None) and type(unpolarized_cache) == type(None), "--batch_size can't be combined with --cache_dir"
 
-def save_images(images, path, extension=".png"):
-	N = images.shape[0]
-	os.makedirs(path, exist_ok=True)
+		unpolarized_batches = iter_render_batches(unpolarized_scene, radius, thetas[indices], phis[indices], polarized=False, spp=spp, batch_size=batch_size)
 
-	for i in tqdm(range(N), desc="Saving", total=N):
-		output = os.path.join(path, str(i).zfill(4) + extension)
-		image = np.squeeze(images[i])
+		if stokes:
+			polarized_batches = iter_render_batches(polarized_scene, radius, thetas[indices], phis[indices], polarized=True, spp=spp, integrator=polarized_integrator, angles=angles, stokes=True, batch_size=batch_size)
 
-		ski.io.imsave(output, to_ski_image(image), check_contrast=False)
+	with ImageWriter(max_pending) as writer, moved_away(unpolarized_scene, ["polarizer_cam"]):
+		for i, mask in tqdm(views, desc="Rendering", total=total):
+			theta, phi = thetas[i], phis[i]
+			name = str(i).zfill(4)
 
-def output_poses(scene, output_path, radius, thetas, phis, num_train_cams):
-	params = mi.traverse(scene)
+			# Pixels outside of the mask are discarded anyway, so only the window around it is rendered
+			crop = mask_crop(mask) if crop_to_mask else None
 
-	width, height = params["sensor.film.size"]
-	principal_point_x = width / 2 + params["sensor.principal_point_offset_x"][0]
-	principal_point_y = height / 2 + params["sensor.principal_point_offset_y"][0]
-	focal_length = fov_to_focal(params["sensor.x_fov"][0], width)
+			if type(sampler) != type(None):
+				sampler.mask = mask if type(crop) == type(None) else mask[crop[1]:crop[1] + crop[3], crop[0]:crop[0] + crop[2]]
+				sampler.view_index = i
+				sampler.history = []
 
-	cameras = []
+			writer.write(os.path.join(mask_path, name + ".png.png"), mask)
 
-	for i, theta, phi in tqdm(zip(range(len(thetas)), thetas, phis), desc="Writing", total=len(thetas)):
-		camera_position = spherical_to_cartesian(radius, theta, phi)
-		transform = mi.Transform4f().look_at(origin=camera_position, target=[0, 0, 0], up=[0, -1, 0])
-		view_matrix = transform.matrix.numpy()[..., 0]
+			if type(unpolarized_batches) != type(None):
+				unpolarized_image = next(unpolarized_batches)[0]
+			else:
+				unpolarized_image = render_from_angle(unpolarized_scene, radius, theta, phi, polarized=False, spp=spp, cache=unpolarized_cache, sampler=sampler, crop=crop)[0]
 
-		view_matrix = view_matrix_inverse(view_matrix) # COLMAP expects Cam-to-World Transformation
+			writer.write(os.path.join(unpolarized_path, name + extension), mask_images(unpolarized_image, mask, white_background))
 
-		extr_obj = {}
-		extr_obj["view_matrix"] = view_matrix.flatten().tolist()
+			if type(work_queue) != type(None):
+				work_queue.renew(i)
 
-		cam_matrix = np.identity(3)
-		cam_matrix[0, 0] = focal_length
-		cam_matrix[1, 1] = focal_length
-		cam_matrix[0, 2] = principal_point_x
-		cam_matrix[1, 2] = principal_point_y
+			if type(polarized_batches) != type(None):
+				polarized_images = next(polarized_batches)
+			else:
+				polarized_images = render_from_angle(polarized_scene, radius, theta, phi, polarized=True, spp=spp, integrator=polarized_integrator, angles=angles, stokes=stokes, cache=polarized_cache, sampler=sampler, crop=crop)
 
-		intr_obj = {}
-		intr_obj["camera_matrix"] = cam_matrix.flatten().tolist()
-		intr_obj["resolution"] = [width, height]
+			for angle, path, image in zip(angles, polarized_paths, polarized_images):
+				# Only the parallel image gets a white background, the orthogonal one is used for separation
+				writer.write(os.path.join(path, name + extension), mask_images(image, mask, white_background and angle == 0))
 
-		cam_obj = {}
-		cam_obj["camera_id"] = str(i).zfill(4) + ".png"
-		cam_obj["extrinsics"] = extr_obj
-		cam_obj["intrinsics"] = intr_obj
-		cam_obj["is_test_cam"] = (i >= num_train_cams)
-		
-		cameras.append(cam_obj)
+			view_manifest = {}
 
-	poses = {}
-	poses["cameras"] = cameras
+			if type(sampler) != type(None):
+				view_manifest = {"unpolarized": sampler.history[0], "polarized": sampler.history[1:]}
 
-	with open(os.path.join(output_path, "poses.json"), "w") as outfile:
-		json.dump(poses, outfile, indent=2)
+			if len(render_timings) > 0:
+				view_manifest["timings"] = list(render_timings)
+				render_timings.clear()
+
+			if len(view_manifest) > 0:
+				writer.call(write_view_manifest, output_path, name, view_manifest)
+
+			if type(work_queue) != type(None):
+				# Runs once all images of this view are on disk
+				writer.call(work_queue.mark_done, i)
+
+def write_view_manifest(output_path, name, view_manifest):
+	# Render statistics go to one file per view, so they are kept if a run crashes and workers don't overwrite
+	# each other's entries
+	manifest_path = os.path.join(output_path, "manifest")
+	os.makedirs(manifest_path, exist_ok=True)
+
+	tmp_path = os.path.join(manifest_path, f"{name}.json.{os.getpid()}.tmp")
+	with open(tmp_path, "w") as f:
+		json.dump(view_manifest, f, indent=2, sort_keys=True)
+	os.replace(tmp_path, os.path.join(manifest_path, name + ".json"))
+
+def mask_images(images, masks, white_background=False):
+	if white_background:
+		return images * masks[..., None] + (1 - masks[..., None])
+	else:
+		return images * masks[..., None]
 
 def main():
 	parser = argparse.ArgumentParser()
@@ -147,6 +184,32 @@ def main():
 	parser.add_argument("--samples", "--spp", default=512, type=int, required=False)
 	parser.add_argument("--image_count", "-c", default=64, type=int, required=False)
 	parser.add_argument("--white_background", "-w", action="store_true", required=False)
+	parser.add_argument("--format", default="png", choices=["png", "exr", "npy"], required=False, help="Image format. exr (half float) and npy (float16) keep the linear radiance, convert them with src/preprocessing/convert_images.py before COLMAP/3DGS.")
+	parser.add_argument("--camera_sequence", default="golden_spiral", choices=list(camera_sequences.keys()), required=False, help="Train camera sequence. With 'r2', the first N cameras are the same for every image count, so an existing dataset is grown by rendering only the new views.")
+	parser.add_argument("--max_pending", default=8, type=int, required=False, help="Maximum number of images waiting to be written to disk.")
+	parser.add_argument("--stokes", action="store_true", required=False, help="Render the Stokes vector once per view and compute all polarizer angles from it.")
+	parser.add_argument("--polarizer_angles", default=[0, 90], type=float, nargs="+", required=False, help="Polarizer angles (in degrees) to output as polarized_<angle>.")
+	parser.add_argument("--mask_spp", default=1, type=int, required=False, help="Primary rays per pixel for the alpha masks (>1 gives antialiased masks).")
+	parser.add_argument("--cache_dir", default="", type=str, required=False, help="Directory of the render cache. Already rendered views are reused from there.")
+	parser.add_argument("--cache_size", default=50, type=float, required=False, help="Maximum size of the render cache in GB.")
+	parser.add_argument("--progressive", action="store_true", required=False, help="Keep accumulation buffers in the render cache, so raising --spp only renders the additional samples.")
+	parser.add_argument("--adaptive", action="store_true", required=False, help="Render in passes until the relative error inside the mask drops below --target_error (at most --spp samples). Per view spp and errors are written to OUTPUT/manifest/<view>.json.")
+	parser.add_argument("--target_error", default=0.01, type=float, required=False)
+	parser.add_argument("--time_budget", default=None, type=float, required=False, help="Maximum seconds per adaptive render.")
+	parser.add_argument("--pass_spp", default=16, type=int, required=False, help="Samples per adaptive rendering pass.")
+	parser.add_argument("--min_passes", default=4, type=int, required=False, help="Passes before an adaptive render may stop on --target_error.")
+	parser.add_argument("--crop", action="store_true", required=False, help="Only render the window around each view's alpha mask.")
+	parser.add_argument("--worker", action="store_true", required=False, help="Claim views from a work queue in OUTPUT/.queue, so several workers can render the same dataset and crashed runs can be resumed.")
+	parser.add_argument("--worker_id", default="", type=str, required=False, help="Worker name, leases of the same worker are reclaimed immediately (default: hostname and --worker_slot).")
+	parser.add_argument("--worker_slot", default=0, type=int, required=False, help="Slot of this worker on its node. Workers running on the same node at once need different slots, a restarted worker reuses its slot to resume.")
+	parser.add_argument("--lease_timeout", default=3600, type=float, required=False, help="Seconds after which a view claimed by another worker is considered abandoned.")
+	parser.add_argument("--batch_size", default=1, type=int, required=False, help="Views rendered per launch (0: as many as fit into the free memory). Polarized views are only batched with --stokes.")
+	parser.add_argument("--max_memory", default=None, type=float, required=False, help="Memory budget of a single render in GB. Larger films are rendered in tiles, e.g. for --res 2048 and above on llvm variants or small GPUs.")
+	parser.add_argument("--asset_cache", default="", type=str, required=False, help="Directory of precompiled scene assets (see src/preprocessing/precompile_scene.py), which are converted on first use.")
+	parser.add_argument("--variant", default="cuda_ad_spectral_polarized", type=str, required=False)
+	parser.add_argument("--debug", action="store_true", required=False, help="Enable Dr.Jit debug mode (slow).")
+	parser.add_argument("--freeze", action="store_true", required=False, help="Record the render function once and replay it for all views (requires Dr.Jit >= 1.1).")
+	parser.add_argument("--profile", action="store_true", required=False, help="Record trace, compile and launch times per render in OUTPUT/manifest/<view>.json.")
 	args = parser.parse_args()
 
 	assert os.path.exists(args.scene)
@@ -156,47 +219,65 @@ def main():
 
 	radius = 75
 
-	# Train views
-	thetas_train, phis_train = golden_spiral(args.image_count)
+	# Train views followed by the test views
+	thetas, phis = camera_angles(args.camera_sequence, args.image_count)
+	rig = CameraRig.from_scene(args.scene, {"res": args.resolution}, radius, thetas, phis, args.image_count, args.camera_sequence)
 
-	# Test views
-	thetas_0 = np.array([0.35*np.pi, 0.5*np.pi, 0.65*np.pi])
-	phis_0 = np.linspace(0, 2*np.pi, 4, endpoint=False)
+	print("Loading scenes...")
+	assert args.variant.endswith("_polarized"), "Polarized rendering requires a *_polarized variant"
+	assert not (args.freeze and args.crop), "--freeze can't be combined with --crop, the crop window changes between views without re-recording"
+	max_memory = args.max_memory * 1024**3 if type(args.max_memory) != type(None) else None
+	BackendConfig(args.variant, args.debug, args.freeze, args.profile, max_memory).apply()
+	# The polarizing flag of the polarizer BSDFs can only be set when loading, so each state is loaded once
+	scene_path = AssetCache(args.asset_cache).precompile(args.scene) if args.asset_cache != "" else args.scene
+	session = SceneSession(scene_path, res=args.resolution)
+	polarized_scene = session.load()
+	unpolarized_scene = session.load(polarizing=False)
+	print()
 
-	thetas_test, phis_test = np.meshgrid(thetas_0, phis_0)
+	if args.cache_dir != "":
+		print("Hashing scene for render cache...")
+		max_cache_size = int(args.cache_size * 1024**3)
+		# The loaded scene is hashed, which is the precompiled one with --asset_cache
+		polarized_cache = RenderCache(args.cache_dir, scene_path, {"res": args.resolution}, max_cache_size, args.progressive)
+		unpolarized_cache = RenderCache(args.cache_dir, scene_path, {"res": args.resolution, "polarizing": False}, max_cache_size, args.progressive)
+		print()
+	else:
+		assert not args.progressive, "Progressive rendering requires --cache_dir"
+		polarized_cache = None
+		unpolarized_cache = None
 
-	thetas = np.concatenate([thetas_train, thetas_test.flatten()])
-	phis = np.concatenate([phis_train, phis_test.flatten()])
+	if args.adaptive:
+		assert args.cache_dir == "", "Adaptive sampling cannot be combined with the render cache"
+		sampler = AdaptiveSampler(args.target_error, args.time_budget, args.pass_spp, args.min_passes)
+	else:
+		sampler = None
 
-	print("Loading scenes...")
-	dr.set_flag(dr.JitFlag.Debug, True)
-	mi.set_variant("cuda_ad_spectral_polarized")
-	polarized_scene = mi.load_file(args.scene, res=args.resolution)
-	unpolarized_scene = mi.load_file(args.scene, res=args.resolution, polarizing=False)
-	print()
+	if args.worker:
+		work_queue = LeaseQueue(os.path.join(args.output, ".queue"), args.worker_id, args.lease_timeout, args.worker_slot)
+		print(f"Worker {work_queue.worker_id}: {len(work_queue.remaining(len(thetas)))} of {len(thetas)} views remaining")
+	else:
+		work_queue = None
 
-	print("Generating alpha masks...")
-	masks = render_masks(polarized_scene, radius, thetas, phis)
-	save_images(masks, os.path.join(args.output, "masks"), extension=".png.png")
-	print()
+	indices = None
 
-	print("Generating unpolarized images...")
-	unpolarized_images = render_unpolarized_images(unpolarized_scene, radius, thetas, phis, args.samples)
-	unpolarized_images = mask_images(unpolarized_images, masks, args.white_background)
-	save_images(unpolarized_images, os.path.join(args.output, "unpolarized", "images"))
-	print()
+	if args.camera_sequence != "golden_spiral":
+		old_train_cams = existing_train_cams(args.output, rig)
 
-	print("Generating polarized images...")
-	polarized_images = render_polarized_images(polarized_scene, radius, thetas, phis, args.samples)
-	# polarized_images = mask_images(polarized_images, masks, args.white_background)
-	polarized_images[:, 0:1, ...] = mask_images(polarized_images[:, 0:1, ...], masks, args.white_background)
-	polarized_images[:, 1:2, ...] = mask_images(polarized_images[:, 1:2, ...], masks)
-	save_images(polarized_images[:, 0, ...], os.path.join(args.output, "polarized_0", "images"))
-	save_images(polarized_images[:, 1, ...], os.path.join(args.output, "polarized_90", "images"))
-	print()
+		if 0 < old_train_cams < args.image_count:
+			assert not args.worker, "Growing a dataset is not supported in worker mode"
 
+			print(f"Growing dataset from {old_train_cams} to {args.image_count} train views...")
+			indices = grow_dataset(args.output, old_train_cams, args.image_count, len(thetas) - args.image_count, args.polarizer_angles, "." + args.format)
+			print()
+
+	# The poses are written first, so an interrupted run is not grown a second time
 	print("Generating camera poses...")
-	output_poses(polarized_scene, args.output, radius, thetas, phis, args.image_count)
+	rig.write_poses(args.output)
+	print()
+
+	print("Generating images...")
+	render_dataset(polarized_scene, unpolarized_scene, args.output, radius, thetas, phis, args.samples, args.white_background, args.max_pending, args.polarizer_angles, args.stokes, args.mask_spp, polarized_cache, unpolarized_cache, work_queue, indices, sampler, args.crop, "." + args.format, args.batch_size)
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
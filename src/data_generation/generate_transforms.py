@@ -1,88 +1,63 @@
 import argparse
 import os
 import json
-import math
 
-import numpy as np
-import mitsuba as mi
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 
 from pathlib import Path
 import sys
 path_root = Path(__file__).parents[1]
 sys.path.append(str(path_root))
 
-from helpers.math_helpers import fov_to_focal, spherical_to_cartesian, sharpness, golden_spiral, closest_point_2_lines
+from helpers.math_helpers import sharpness, camera_sequences
+from helpers.camera_helpers import CameraRig, camera_angles
 
-def output_transforms(scene, scene_path, radius, thetas, phis, num_train_cams, name="transforms.json", start_from=0):
-	params = mi.traverse(scene)
+def sharpness_values(scene_path, file_paths, workers=8):
+	# Sharpness of the scene's images, computed in a thread pool (OpenCV releases the GIL) and cached in
+	# SCENE/sharpness.json along with the size and mtime of each image, so only changed images are computed again
+	cache_path = os.path.join(scene_path, "sharpness.json")
+	cache = {}
 
-	width, height = params["sensor.film.size"]
-	principal_point_x = width / 2 + params["sensor.principal_point_offset_x"][0]
-	principal_point_y = height / 2 + params["sensor.principal_point_offset_y"][0]
-	focal_length = fov_to_focal(params["sensor.x_fov"][0], width)
+	if os.path.exists(cache_path):
+		with open(cache_path, "r") as f:
+			cache = json.load(f)
 
-	transforms = {}
-	transforms["w"] = width
-	transforms["h"] = height
-	transforms["fl_x"] = focal_length
-	transforms["fl_y"] = focal_length
-	transforms["cx"] = principal_point_x
-	transforms["cy"] = principal_point_y
-	transforms["k1"] = 0.0
-	transforms["k2"] = 0.0
-	transforms["p1"] = 0.0
-	transforms["p2"] = 0.0
-	transforms["camera_angle_x"] = math.atan(width / (2 * focal_length)) * 2
-	transforms["camera_angle_y"] = math.atan(height / (2 * focal_length)) * 2
+	keys = {}
+	for file_path in file_paths:
+		stat = os.stat(os.path.join(scene_path, file_path))
+		keys[file_path] = [stat.st_size, stat.st_mtime]
 
-	transforms["aabb_scale"] = 1
-	transforms["frames"] = []
+	missing = [file_path for file_path in keys if file_path not in cache or cache[file_path]["key"] != keys[file_path]]
 
-	for i, theta, phi in tqdm(zip(range(num_train_cams), thetas, phis), desc="Writing", total=num_train_cams):
-		t2 = np.array([[0, 0, 1, 0], [1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]])
+	with ThreadPoolExecutor(workers) as executor:
+		values = list(tqdm(executor.map(sharpness, [os.path.join(scene_path, file_path) for file_path in missing]), desc="Sharpness", total=len(missing)))
 
-		camera_position = spherical_to_cartesian(radius, theta, phi)
-		transform = mi.Transform4f().look_at(origin=camera_position, target=[0, 0, 0], up=[0, 1, 0])
-		# transform = to_frame @ transform
-		view_matrix = transform.matrix.numpy()[..., 0]
+	for file_path, value in zip(missing, values):
+		cache[file_path] = {"key": keys[file_path], "sharpness": value}
 
-		# view_matrix[:3,:3] = t1 @ view_matrix[:3,:3]
-		view_matrix = t2 @ view_matrix
-		view_matrix[:3,0] *= -1
-		view_matrix[:3,2] *= -1
+	if len(missing) > 0:
+		tmp_path = cache_path + f".{os.getpid()}.tmp"
+		with open(tmp_path, "w") as f:
+			json.dump(cache, f, indent=2)
+		os.replace(tmp_path, cache_path)
 
-		# view_matrix = view_matrix_inverse(view_matrix)
+	return {file_path: cache[file_path]["sharpness"] for file_path in file_paths}
 
-		file_path = os.path.join(scene_path, "images", str(i + start_from).zfill(4) + ".png")
-		b = sharpness(file_path)
+def output_transforms(transforms, scene_path, sharpness_by_path, name="transforms.json"):
+	# Adds the sharpness of the scene's images to the frames of the camera rig's transforms
+	frames = []
 
+	for frame in transforms["frames"]:
 		camera = {}
-		camera["file_path"] = os.path.join("images", str(i + start_from).zfill(4) + ".png")
-		camera["sharpness"] = b
-		camera["transform_matrix"] = view_matrix
-
-		transforms["frames"].append(camera)
-
-	totw = 0.0
-	totp = np.array([0.0, 0.0, 0.0])
-	for f in transforms["frames"]:
-		mf = f["transform_matrix"][0:3,:]
-		for g in transforms["frames"]:
-			mg = g["transform_matrix"][0:3,:]
-			p, w = closest_point_2_lines(mf[:,3], mf[:,2], mg[:,3], mg[:,2])
-			if w > 0.00001:
-				totp += p*w
-				totw += w
-	if totw > 0.0:
-		totp /= totw
-	print(totp) # the cameras are looking at totp
-
-	for f in transforms["frames"]:
-		f["transform_matrix"] = f["transform_matrix"].tolist()
+		camera["file_path"] = frame["file_path"]
+		camera["sharpness"] = sharpness_by_path[frame["file_path"]]
+		camera["transform_matrix"] = frame["transform_matrix"]
+
+		frames.append(camera)
 
 	with open(os.path.join(scene_path, name), "w") as outfile:
-		json.dump(transforms, outfile, indent=2)
+		json.dump({**transforms, "frames": frames}, outfile, indent=2)
 
 def main():
 	parser = argparse.ArgumentParser()
@@ -91,28 +66,26 @@ def main():
 	parser.add_argument("--resolution", "--res", "-r", default=512, type=int, required=False)
 	parser.add_argument("--samples", "--spp", default=512, type=int, required=False)
 	parser.add_argument("--image_count", "-c", default=64, type=int, required=False)
+	parser.add_argument("--workers", default=8, type=int, required=False, help="Threads computing the image sharpness.")
+	parser.add_argument("--camera_sequence", default="golden_spiral", choices=list(camera_sequences.keys()), required=False, help="Train camera sequence, has to match the one used in generate_images.py.")
 	args = parser.parse_args()
 
-	# Train views
 	radius = 4 # for nerf scale
-	thetas, phis = golden_spiral(args.image_count)
-
-	thetas_0 = np.array([0.35*np.pi, 0.5*np.pi, 0.65*np.pi])
-	phis_0 = np.linspace(0, 2*np.pi, 4, endpoint=False)
+	thetas, phis = camera_angles(args.camera_sequence, args.image_count)
 
-	thetas_test, phis_test = np.meshgrid(thetas_0, phis_0)
-	thetas_test = thetas_test.flatten()
-	phis_test = phis_test.flatten()
+	# Only the sensor block of the scene is parsed, the poses are the same for all scenes
+	rig = CameraRig.from_scene(args.scene, {"res": args.resolution}, radius, thetas, phis, args.image_count, args.camera_sequence)
 
-	print("Loading scenes...")
-	mi.set_variant("cuda_ad_spectral_polarized")
-	polarized_scene = mi.load_file(args.scene, res=args.resolution)
-	print()
+	train_transforms = rig.transforms()
+	test_transforms = rig.transforms(test=True)
 
 	for scene in ["unpolarized", "direct", "global"]:
-		output_transforms(polarized_scene, os.path.join(args.output, scene), radius, thetas, phis, args.image_count)
-		output_transforms(polarized_scene, os.path.join(args.output, scene), radius, thetas_test, phis_test, len(thetas_test), name="transforms_test.json", start_from=args.image_count)
+		scene_path = os.path.join(args.output, scene)
+		sharpness_by_path = sharpness_values(scene_path, [frame["file_path"] for frame in train_transforms["frames"] + test_transforms["frames"]], args.workers)
+
+		output_transforms(train_transforms, scene_path, sharpness_by_path)
+		output_transforms(test_transforms, scene_path, sharpness_by_path, name="transforms_test.json")
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
@@ -1,12 +1,11 @@
 import argparse
+import json
 import os
+import shutil
 import struct
-import random
 import numpy as np
 from tqdm import tqdm
-
-def rand_float(min: float, max: float):
-	return min + random.random() / (max - min)
+from concurrent.futures import ProcessPoolExecutor
 
 def read_uint(bytes):
 	return int.from_bytes(bytes, byteorder="little", signed=False)
@@ -39,112 +38,270 @@ class Header:
 		self.default_transparency = read_float(header_bytes[24:28])
 		self.default_color       = [read_float(header_bytes[28:32]), read_float(header_bytes[32:36]), read_float(header_bytes[36:40])]
 
-def get_strand(strand_idx: int, header: Header, points, segments, start_indices, offset=(0, 0, 0)) -> list[tuple[int, int, int]]:
-	if header.has_segments_arr:
-		strand_length = segments[strand_idx] + 1
-	else:
-		strand_length = header.default_num_segments + 1
+class HairFile:
+	"""
+	Arrays of a .hair file, mapped from disk at the offsets following from the header. The strands are views
+	into the (num_points, 3) points array, starting at start_indices.
+	"""
 
-	strand = []
+	def __init__(self, path: str):
+		data = np.memmap(path, dtype=np.uint8, mode="r")
 
-	start = start_indices[strand_idx]
-	end = start + strand_length
+		self.header = Header(bytes(data[:128])) # Header consists of first 128 bytes
+		offset = 128
 
-	for point in range(start, end):
-		segment = (round(points[3 * point + 0], 6) + offset[0], round(points[3 * point + 1], 6) + offset[1], round(points[3 * point + 2], 6) + offset[2])
-		strand.append(segment)
+		num_strands, num_points = self.header.num_strands, self.header.num_points
 
-	return strand
+		def read_array(dtype, count):
+			nonlocal offset
+			array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+			offset += array.nbytes
+			return array
 
-def strand_to_string(strand: list[tuple[int, int, int]], radius=0.004):
-	return "".join([" ".join([str(i) for i in point]) + " " + str(radius) + "\n" for point in strand]) + "\n"
+		if self.header.has_segments_arr:
+			self.segments = read_array("<u2", num_strands)
+		else:
+			self.segments = np.full(num_strands, self.header.default_num_segments, dtype=np.uint16)
 
-def convert(input: str, output: str, target_strands: int):
-	with open(input, "rb") as f:
-		header = Header(f.read(128)) # Header consists of first 128 bytes
+		self.points = read_array("<f4", 3 * num_points).reshape(num_points, 3)
+		self.thickness = read_array("<f4", num_points) if self.header.has_thickness_arr else None
+		self.transparency = read_array("<f4", num_points) if self.header.has_transparency_arr else None
+		self.color = read_array("<f4", 3 * num_points).reshape(num_points, 3) if self.header.has_color_arr else None
 
-		print("Number of strands:", header.num_strands)
-		print("Number of points:", header.num_points)
-		print(f"Default color: {header.default_color}")
+		self.strand_lengths = self.segments.astype(np.int64) + 1
+		self.start_indices = np.cumsum(self.strand_lengths) - self.strand_lengths
 
-		print()
-		print("Present Arrays:")
+	def strand(self, strand_idx: int) -> np.ndarray:
+		start = self.start_indices[strand_idx]
+		return self.points[start:start + self.strand_lengths[strand_idx]]
 
-		if header.has_segments_arr:
-			print("Segments array present")
-			segments_bytes = f.read(2 * header.num_strands)
-			segments = struct.unpack("<"+"H"*header.num_strands, segments_bytes)
-		else:
-			segments = None
+def strand_points(hair: HairFile, strand_ids: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+	# Points of all given strands in one (N, 3) array, rounded and moved by the per strand offsets
+	lengths = hair.strand_lengths[strand_ids]
+	ends = np.cumsum(lengths)
 
-		if header.has_points_arr:
-			print("Points array present")
-			points_bytes = f.read(3 * 4 * header.num_points)
-			points = struct.unpack("<"+"f"*3*header.num_points, points_bytes)
-		else:
-			points = None
+	point_indices = np.repeat(hair.start_indices[strand_ids] - ends + lengths, lengths) + np.arange(ends[-1])
+	points = np.round(hair.points[point_indices].astype(np.float64), 6) + np.repeat(offsets, lengths, axis=0)
 
-		if header.has_thickness_arr:
-			print("Thickness array present")
-			thickness_bytes = f.read(4 * header.num_points)
-			thickness = struct.unpack("<"+"f"*header.num_points, thickness_bytes)
-		else:
-			thickness = None
+	return points, lengths
 
-		if header.has_transparency_arr:
-			print("Transparency array present")
-			transparency_bytes = f.read(4 * header.num_points)
-			transparency = struct.unpack("<"+"f"*header.num_points, transparency_bytes)
-		else:
-			transparency = None
+def strands_to_string(points: np.ndarray, lengths: np.ndarray, radius=0.004) -> str:
+	# One line per point and an empty line after each strand, formatted by a single % operation
+	line = f"%s %s %s {radius}\n"
 
-		if header.has_color_arr:
-			print("Color array present")
-			color_bytes = f.read(3 * 4 * header.num_points)
-			color = struct.unpack("<"+"f"*3*header.num_points, color_bytes)
-		else:
-			color = None
+	formats = np.full(len(points), line, dtype=object)
+	formats[np.cumsum(lengths) - 1] = line + "\n"
+
+	return "".join(formats) % tuple(points.ravel().tolist())
+
+def point_segment_distance(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+	ab = b - a
+	t = np.clip(np.sum((p - a) * ab, axis=-1) / np.maximum(np.sum(ab * ab, axis=-1), 1e-20), 0, 1)
+
+	return np.linalg.norm(a + t[:, None] * ab - p, axis=-1)
+
+def simplify_strands(points: np.ndarray, lengths: np.ndarray, max_error: float, min_points=4) -> tuple[np.ndarray, np.ndarray, float]:
+	# Removes control points of all strands at once, as long as the chord between the neighbours of a removed
+	# point stays within max_error of all original points it replaces. Points in strongly curved parts are
+	# therefore kept. Strands keep their end points and at least min_points points (cubic B-splines need 4).
+	strand = np.repeat(np.arange(len(lengths)), lengths)
+	segment_error = np.zeros(len(points)) # Error bound of the segment from each point to the next one
+
+	while len(points) > 2:
+		idx = np.flatnonzero((strand[:-2] == strand[1:-1]) & (strand[1:-1] == strand[2:])) + 1
+
+		error = np.full(len(points), np.inf)
+		error[idx] = point_segment_distance(points[idx], points[idx - 1], points[idx + 1]) + np.maximum(segment_error[idx - 1], segment_error[idx])
+
+		# Only points with a lower error than both neighbours are removed per pass, so no two neighbours go at once
+		remove = error <= max_error
+		remove[1:] &= error[1:] < error[:-1]
+		remove[:-1] &= error[:-1] <= error[1:]
+
+		# Limit the removed points per strand, so that min_points remain
+		counts = np.bincount(strand, minlength=len(lengths))
+		removed_before = np.cumsum(remove) - remove
+		strand_starts = np.cumsum(counts) - counts
+		remove &= removed_before - removed_before[strand_starts[strand]] < counts[strand] - min_points
+
+		if not np.any(remove):
+			break
+
+		segment_error[np.flatnonzero(remove) - 1] = error[remove]
 
-		print()
+		points, strand, segment_error = points[~remove], strand[~remove], segment_error[~remove]
 
-	start_indices = []
+	return points, np.bincount(strand, minlength=len(lengths)), float(segment_error.max(initial=0))
 
-	lines = []
+def chunk_strands(hair: HairFile, chunk_idx: int, chunk_size: int, total_strands: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+	# Output strands below num_strands are the original ones, the others are randomly picked strands moved by a
+	# small random offset. Every chunk has its own generator, so the output does not depend on the processing order.
+	strand_ids = np.arange(chunk_idx * chunk_size, min((chunk_idx + 1) * chunk_size, total_strands))
+	offsets = np.zeros((len(strand_ids), 3))
+
+	densified = strand_ids >= hair.header.num_strands
+	rng = np.random.default_rng([seed, chunk_idx])
+
+	strand_ids[densified] = rng.integers(0, hair.header.num_strands, size=np.count_nonzero(densified))
+	offsets[densified] = rng.uniform(-0.1, 0.1, size=(np.count_nonzero(densified), 3))
+
+	return strand_ids, offsets
+
+def chunk_to_string(hair: HairFile, chunk_idx: int, chunk_size: int, total_strands: int, seed: int, radius=0.004) -> str:
+	return strands_to_string(*strand_points(hair, *chunk_strands(hair, chunk_idx, chunk_size, total_strands, seed)), radius=radius)
+
+def lod_chunk(hair: HairFile, chunk_idx: int, chunk_size: int, total_strands: int, seed: int, lod: dict, radius=0.004) -> tuple[str, dict]:
+	# Keeps a random fraction of the strands (the same draw for all levels, so lower levels are subsets of higher
+	# ones), widens their radius by the inverse fraction to keep the covered area and simplifies them
+	strand_ids, offsets = chunk_strands(hair, chunk_idx, chunk_size, total_strands, seed)
+
+	keep = np.random.default_rng([seed, chunk_idx, 1]).random(len(strand_ids)) < lod["fraction"]
+	stats = {"strands": int(np.count_nonzero(keep)), "points": 0, "full_points": int(hair.strand_lengths[strand_ids].sum()), "error": 0.0}
+
+	if stats["strands"] == 0:
+		return "", stats
+
+	points, lengths = strand_points(hair, strand_ids[keep], offsets[keep])
+	points, lengths, stats["error"] = simplify_strands(points, lengths, lod["max_error"])
+	stats["points"] = len(points)
+
+	return strands_to_string(points, lengths, radius=radius / lod["fraction"]), stats
+
+def convert(input: str, output: str, target_strands: int, seed=None, chunk_size=10_000, lods=[], workers=1):
+	hair = HairFile(input)
+	header = hair.header
+
+	print("Number of strands:", header.num_strands)
+	print("Number of points:", header.num_points)
+	print(f"Default color: {header.default_color}")
+
+	print()
+	print("Present Arrays:")
+
+	if header.has_segments_arr:
+		print("Segments array present")
+	if header.has_points_arr:
+		print("Points array present")
+	if header.has_thickness_arr:
+		print("Thickness array present")
+	if header.has_transparency_arr:
+		print("Transparency array present")
+	if header.has_color_arr:
+		print("Color array present")
+
+	print()
 
 	radius = 0.004
-	point_idx = 0
+	total_strands = max(target_strands, header.num_strands)
 
-	print("Converting Strands:")
-	for strand_idx in tqdm(range(header.num_strands), total=header.num_strands):
-		start_indices.append(point_idx)
+	if type(seed) == type(None):
+		seed = np.random.SeedSequence().entropy
 
-		strand = get_strand(strand_idx, header, points, segments, start_indices)
-		line = strand_to_string(strand, radius=radius)
-		lines.append(line)
+	print(f"Converting and densifying to {total_strands} strands (seed {seed}):")
+	num_chunks = (total_strands + chunk_size - 1) // chunk_size
 
-		point_idx += len(strand)
+	write_chunks(input, output, num_chunks, chunk_size, total_strands, seed, radius, workers=workers)
 
-	print("Densifiying:")
-	for i in tqdm(range(max(target_strands - header.num_strands, 0)), total=max(target_strands - header.num_strands, 0)):
-		strand_idx = random.randint(0, header.num_strands-1)
-		offset = (rand_float(-0.1, 0.1), rand_float(-0.1, 0.1), rand_float(-0.1, 0.1))
-		strand = get_strand(strand_idx, header, points, segments, start_indices, offset)
-		line = strand_to_string(strand, radius=radius)
-		lines.append(line)
+	for level, lod in enumerate(lods):
+		print(f"Writing LOD {level} (fraction {lod['fraction']}, max error {lod['max_error']}):")
 
+		lod.update(write_chunks(input, lod_path(output, level), num_chunks, chunk_size, total_strands, seed, radius, lod, workers))
+
+	if len(lods) > 0:
+		write_lod_report(output, lods, radius)
+
+def merge_stats(stats: dict, other: dict) -> dict:
+	return {key: max(value, other[key]) if key == "error" else value + other[key] for key, value in stats.items()}
+
+def convert_segment(input: str, output: str, chunk_indices: range, chunk_size: int, total_strands: int, seed: int, radius: float, lod=None, progress=False) -> dict:
+	# Writes the given chunks to output. Run in worker processes, which map the same input file.
+	hair = HairFile(input)
+	stats = {"strands": 0, "points": 0, "full_points": 0, "error": 0.0}
 
 	with open(output, "w") as f:
-		f.writelines(lines)
+		for chunk_idx in tqdm(chunk_indices, total=len(chunk_indices), disable=not progress):
+			if type(lod) == type(None):
+				f.write(chunk_to_string(hair, chunk_idx, chunk_size, total_strands, seed, radius))
+			else:
+				text, chunk_stats = lod_chunk(hair, chunk_idx, chunk_size, total_strands, seed, lod, radius)
+				f.write(text)
+
+				stats = merge_stats(stats, chunk_stats)
+
+	return stats
+
+def write_chunks(input: str, output: str, num_chunks: int, chunk_size: int, total_strands: int, seed: int, radius: float, lod=None, workers=1) -> dict:
+	# Written chunk by chunk, so memory usage does not depend on the number of strands. With several workers,
+	# each one writes contiguous chunks to its own segment file and the segments are concatenated in order.
+	# As every chunk has its own generator, the output is the same as with a single worker.
+	if workers <= 1:
+		return convert_segment(input, output, range(num_chunks), chunk_size, total_strands, seed, radius, lod, progress=True)
+
+	num_segments = min(num_chunks, 4 * workers)
+	bounds = np.linspace(0, num_chunks, num_segments + 1).astype(int)
+	segment_paths = [output + f".part{i}" for i in range(num_segments)]
+
+	with ProcessPoolExecutor(workers) as executor:
+		futures = [executor.submit(convert_segment, input, path, range(start, end), chunk_size, total_strands, seed, radius, lod) for path, start, end in zip(segment_paths, bounds[:-1], bounds[1:])]
+
+		stats = {"strands": 0, "points": 0, "full_points": 0, "error": 0.0}
+		for future in tqdm(futures, total=num_segments):
+			stats = merge_stats(stats, future.result())
+
+	with open(output, "wb") as f:
+		for path in segment_paths:
+			with open(path, "rb") as segment:
+				shutil.copyfileobj(segment, f)
+
+			os.remove(path)
+
+	return stats
+
+def lod_path(output: str, level: int) -> str:
+	return os.path.splitext(output)[0] + f"_lod{level}" + os.path.splitext(output)[1]
+
+def write_lod_report(output: str, lods: list[dict], radius: float):
+	# Point count and error bound of every level, relative to the full hair written to output
+	report = {"output": output, "levels": []}
+
+	for level, lod in enumerate(lods):
+		report["levels"].append({
+			"path": lod_path(output, level),
+			"fraction": lod["fraction"],
+			"max_error": lod["max_error"],
+			"radius": radius / lod["fraction"],
+			"strands": lod["strands"],
+			"points": lod["points"],
+			"point_ratio": lod["points"] / lod["full_points"],
+			"error_bound": lod["error"]
+		})
+
+	with open(os.path.splitext(output)[0] + "_lod.json", "w") as f:
+		json.dump(report, f, indent=2)
+
+	print()
+	print("LOD     Strands      Points   Ratio   Error bound")
+	for level, lod in enumerate(report["levels"]):
+		print(f"{level:<3} {lod['strands']:>11} {lod['points']:>11}   {lod['point_ratio']:.3f}   {lod['error_bound']:.6f}")
 
 def main():
 	parser = argparse.ArgumentParser()
 	parser.add_argument("--input", "-i", type=str, required=True)
 	parser.add_argument("--output", "-o", default="", type=str, required=False)
 	parser.add_argument("--target_strands", default=75_000, type=int, required=False)
+	parser.add_argument("--seed", default=None, type=int, required=False, help="Seed of the densification, for reproducible output.")
+	parser.add_argument("--chunk_size", default=10_000, type=int, required=False, help="Strands converted and written at once.")
+	parser.add_argument("--workers", default=1, type=int, required=False, help="Processes converting chunks in parallel. The output is the same as with one worker for a fixed --seed.")
+	parser.add_argument("--lod_errors", default=[], type=float, nargs="*", required=False, help="Maximum control point error (in hair units) of each level of detail, written to OUTPUT_lod<level>.txt.")
+	parser.add_argument("--lod_fractions", default=[], type=float, nargs="*", required=False, help="Fraction of strands kept in each level of detail, their radius is widened by the inverse fraction (default: 1 for all levels).")
 	args = parser.parse_args()
 
 	assert os.path.exists(args.input)
 
+	lod_fractions = args.lod_fractions if len(args.lod_fractions) > 0 else [1.0] * len(args.lod_errors)
+	assert len(lod_fractions) == len(args.lod_errors), "--lod_fractions needs one value per --lod_errors level"
+	lods = [{"max_error": error, "fraction": fraction} for error, fraction in zip(args.lod_errors, lod_fractions)]
+
 	in_path = args.input
 	out_path = args.output
 
@@ -152,7 +309,7 @@ def main():
 		name_wo_extension = os.path.splitext(in_path)[0]
 		out_path = name_wo_extension + ".txt"
 
-	convert(in_path, out_path, args.target_strands)
+	convert(in_path, out_path, args.target_strands, args.seed, args.chunk_size, lods, args.workers)
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
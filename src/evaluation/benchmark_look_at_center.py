@@ -0,0 +1,63 @@
+import argparse
+import time
+
+import numpy as np
+
+from pathlib import Path
+import sys
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from helpers.math_helpers import closest_point_2_lines, look_at_center, look_at_batch, spherical_to_cartesian, camera_sequences
+
+def look_at_center_loop(origins, directions):
+	# Reference implementation with one closest_point_2_lines call per pair of cameras
+	totw = 0.0
+	totp = np.array([0.0, 0.0, 0.0])
+	for oa, da in zip(origins, directions):
+		for ob, db in zip(origins, directions):
+			p, w = closest_point_2_lines(oa, da, ob, db)
+			if w > 0.00001:
+				totp += p*w
+				totw += w
+	if totw > 0.0:
+		totp /= totw
+	return totp
+
+def camera_rays(count, radius=4):
+	thetas, phis = camera_sequences["golden_spiral"](count)
+	origins = spherical_to_cartesian(radius, thetas, phis)
+
+	# Slightly perturbed targets, so the result is not trivially the origin
+	targets = np.random.default_rng(0).normal(scale=0.1, size=(count, 3))
+	directions = look_at_batch(origins, targets, [0, 1, 0])[:, :3, 2]
+
+	return origins, directions
+
+def main():
+	parser = argparse.ArgumentParser(description="Compare the pairwise look-at centre estimation of generate_transforms.py with the previous per-pair loop.")
+	parser.add_argument("--counts", default=[64, 256, 1024, 4096], type=int, nargs="+", required=False)
+	parser.add_argument("--max_loop_count", default=256, type=int, required=False, help="Largest camera count the per-pair loop is run for.")
+	args = parser.parse_args()
+
+	print(" Cameras    Batched [s]    Loop [s]    Max difference")
+
+	for count in args.counts:
+		origins, directions = camera_rays(count)
+
+		start = time.perf_counter()
+		center = look_at_center(origins, directions)
+		batched_time = time.perf_counter() - start
+
+		if count <= args.max_loop_count:
+			start = time.perf_counter()
+			reference = look_at_center_loop(origins, directions)
+			loop_time = f"{time.perf_counter() - start:11.4f}"
+			difference = f"{np.abs(center - reference).max():.2e}"
+		else:
+			loop_time, difference = f"{'-':>11}", "-"
+
+		print(f"{count:8} {batched_time:14.4f} {loop_time}    {difference}")
+
+if __name__ == "__main__":
+	main()
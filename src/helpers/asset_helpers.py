@@ -0,0 +1,143 @@
+import numpy as np
+import mitsuba as mi
+import json
+import os
+import xml.etree.ElementTree as ET
+
+from helpers.scene_helpers import scene_defaults, substitute, flatten_scene
+from helpers.cache_helpers import hash_file
+
+class AssetCache:
+	"""
+	Converts the assets of a scene once into forms that load faster and writes a scene XML referencing them.
+	Meshes become binary PLY files, bitmap textures are decoded into half float EXR files and curve files are
+	rewritten in a compact form. Converted files are reused as long as size and mtime of their source match,
+	and otherwise only converted again if the source content changed.
+	"""
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		self.manifest_path = os.path.join(cache_dir, "manifest.json")
+		self.manifest = {}
+
+		os.makedirs(cache_dir, exist_ok=True)
+
+		if os.path.exists(self.manifest_path):
+			with open(self.manifest_path, "r") as f:
+				self.manifest = json.load(f)
+
+	def save_manifest(self):
+		tmp_path = self.manifest_path + f".{os.getpid()}.tmp"
+		with open(tmp_path, "w") as f:
+			json.dump(self.manifest, f, indent=2, sort_keys=True)
+		os.replace(tmp_path, self.manifest_path)
+
+	def convert(self, source, kind, convert_fn, extension, options={}):
+		# The key also contains the conversion options, e.g. the same PNG is decoded differently as raw texture
+		key = json.dumps([kind, source, options], sort_keys=True)
+		entry = self.manifest.get(key)
+		stat = os.stat(source)
+
+		if type(entry) != type(None) and os.path.exists(entry["output"]):
+			if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+				return entry["output"]
+
+			digest = hash_file(source).hexdigest()
+
+			if entry["hash"] == digest:
+				entry["mtime"] = stat.st_mtime
+				return entry["output"]
+		else:
+			digest = hash_file(source).hexdigest()
+
+		name = os.path.splitext(os.path.basename(source))[0]
+		output = os.path.join(self.cache_dir, f"{name}_{digest[:12]}{extension}")
+
+		print(f"Converting {source}")
+		tmp_path = output + f".{os.getpid()}.tmp{extension}"
+		convert_fn(source, tmp_path, **options)
+		os.replace(tmp_path, output)
+
+		self.manifest[key] = {"output": output, "hash": digest, "size": stat.st_size, "mtime": stat.st_mtime}
+
+		return output
+
+	def precompile(self, scene_path, args={}):
+		root = flatten_scene(scene_path, args)
+		args = {**scene_defaults(root), **args}
+
+		for element in root.iter():
+			self.convert_element(element, args)
+
+		self.save_manifest()
+
+		output = os.path.join(self.cache_dir, os.path.basename(scene_path))
+		ET.ElementTree(root).write(output)
+
+		return output
+
+	def convert_element(self, element, args):
+		filename = next((child for child in element if child.tag == "string" and child.get("name") == "filename"), None)
+
+		if type(filename) == type(None) or "$" in filename.get("value"):
+			return
+
+		source = filename.get("value")
+		plugin = (element.tag, element.get("type"))
+
+		if plugin in [("shape", "obj"), ("shape", "ply")]:
+			options = {"flip_tex_coords": bool_value(element, "flip_tex_coords", plugin[1] == "obj", args)}
+
+			filename.set("value", self.convert(source, "mesh", convert_mesh, ".ply", options))
+
+			# The texture coordinates are already flipped in the converted mesh
+			element.set("type", "ply")
+			for child in list(element):
+				if child.get("name") == "flip_tex_coords":
+					element.remove(child)
+		elif plugin == ("texture", "bitmap") and os.path.splitext(source)[1].lower() != ".exr":
+			options = {"raw": bool_value(element, "raw", False, args)}
+
+			filename.set("value", self.convert(source, "texture", convert_texture, ".exr", options))
+		elif element.tag == "shape" and plugin[1] in ["bsplinecurve", "linearcurve"]:
+			filename.set("value", self.convert(source, "curves", convert_curves, ".txt", {"digits": 9}))
+
+def bool_value(element, name, default, args):
+	child = next((child for child in element if child.tag == "boolean" and child.get("name") == name), None)
+
+	if type(child) == type(None):
+		return default
+
+	return substitute(child.get("value"), args).lower() == "true"
+
+def convert_mesh(source, output, flip_tex_coords=True):
+	# Loaded in object space, the transform stays in the scene XML
+	mesh_type = os.path.splitext(source)[1][1:].lower()
+	mesh = mi.load_dict({"type": mesh_type, "filename": source, **({"flip_tex_coords": flip_tex_coords} if mesh_type == "obj" else {})})
+	mesh.write_ply(output)
+
+def convert_texture(source, output, raw=False):
+	bitmap = mi.Bitmap(source)
+
+	if raw:
+		# Raw textures (e.g. normal maps) keep their stored values instead of being converted to linear
+		bitmap.set_srgb_gamma(False)
+
+	bitmap = bitmap.convert(component_format=mi.Struct.Type.Float16, srgb_gamma=False)
+	bitmap.write(output)
+
+def convert_curves(source, output, digits=9):
+	# Mitsuba only reads ASCII curve files, so the points are written without redundant characters, one strand
+	# per block. 9 significant digits round trip every float32 value, so the geometry is unchanged.
+	point_format = " ".join([f"%.{digits}g"] * 4) + "\n"
+
+	with open(source, "r") as f:
+		blocks = [block.split() for block in f.read().split("\n\n")]
+
+	with open(output, "w") as f:
+		for block in blocks:
+			if len(block) == 0:
+				continue
+
+			points = np.array(block, dtype=np.float32).reshape(-1, 4)
+			f.write("".join(point_format % tuple(point) for point in points) + "\n")
@@ -0,0 +1,112 @@
+import os
+import subprocess
+import time
+import mitsuba as mi
+import drjit as dr
+
+class BackendConfig:
+	"""
+	Dr.Jit/Mitsuba backend settings: variant, debug and profiling flags, whether mi.render is recorded once
+	as frozen function and replayed for later views instead of being traced again and the memory (in bytes)
+	a single render may use, above which the film is rendered in tiles. Kernels are cached on disk
+	by Dr.Jit in kernel_cache_dir, which is only reported, as Dr.Jit does not allow changing it.
+	"""
+
+	def __init__(self, variant="cuda_ad_spectral_polarized", debug=False, freeze=False, profile=False, max_memory=None):
+		self.variant = variant
+		self.debug = debug
+		self.freeze = freeze
+		self.profile = profile
+		self.max_memory = max_memory
+		self.kernel_cache_dir = os.path.join(os.path.expanduser("~"), ".drjit")
+
+	def apply(self):
+		mi.set_variant(self.variant)
+
+		dr.set_flag(dr.JitFlag.Debug, self.debug)
+		dr.set_flag(dr.JitFlag.KernelHistory, self.profile)
+
+		# Tiles are rendered through the film's crop window, a scalar parameter that frozen kernels don't track
+		assert not (self.freeze and type(self.max_memory) != type(None)), "Frozen rendering can't be combined with a memory budget (--max_memory)"
+
+		if self.freeze and not hasattr(dr, "freeze"):
+			print("Function freezing requires Dr.Jit >= 1.1, rendering without it")
+			self.freeze = False
+
+		set_render_function(frozen_render_function() if self.freeze else None)
+		set_render_memory_budget(self.max_memory)
+
+		print(f"Variant: {self.variant}, debug: {self.debug}, frozen rendering: {self.freeze}, kernel cache: {self.kernel_cache_dir}")
+
+def frozen_render_function():
+	# Recorded on the first call and replayed as long as the scene structure, integrator and spp stay the same.
+	# Changed parameters like the sensor transform or polarizer angle are inputs of the replayed kernels.
+	@dr.freeze
+	def frozen_render(scene, integrator, spp, seed, sensor=0):
+		return mi.render(scene, sensor=sensor, integrator=integrator, spp=spp, seed=seed)
+
+	return frozen_render
+
+render_function = None
+
+def set_render_function(function):
+	global render_function
+	render_function = function
+
+render_memory_budget_bytes = None
+
+def set_render_memory_budget(max_memory):
+	global render_memory_budget_bytes
+	render_memory_budget_bytes = max_memory
+
+def render_memory_budget():
+	return render_memory_budget_bytes
+
+render_timings = []
+
+def available_memory(fallback=4 * 1024**3):
+	# Free device memory for the CUDA variants, free host memory for the LLVM/scalar ones
+	if not mi.variant().startswith("cuda"):
+		return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+	# Dr.Jit renders on the first visible device, nvidia-smi ignores CUDA_VISIBLE_DEVICES and needs its index or UUID
+	device = os.environ.get("CUDA_VISIBLE_DEVICES", "0").split(",")[0].strip() or "0"
+
+	try:
+		output = subprocess.run(["nvidia-smi", f"--id={device}", "--query-gpu=memory.free", "--format=csv,noheader,nounits"], capture_output=True, text=True, check=True, timeout=10).stdout
+		return int(output.split()[0]) * 1024**2 # MiB
+	except (OSError, subprocess.SubprocessError, ValueError, IndexError) as e:
+		print(f"Could not query the free device memory with nvidia-smi ({e}), assuming {fallback / 1024**3:g} GB")
+		return fallback
+
+def timed_render(scene, spp, integrator=None, seed=0, sensor=0):
+	profile = dr.flag(dr.JitFlag.KernelHistory)
+
+	if profile:
+		dr.kernel_history() # Discard kernels launched before this render
+
+	start = time.perf_counter()
+
+	if type(render_function) != type(None):
+		image = render_function(scene, integrator, spp, mi.UInt32(seed), sensor)
+	else:
+		image = mi.render(scene, sensor=sensor, integrator=integrator, spp=spp, seed=seed)
+
+	image = image.numpy()
+	total = time.perf_counter() - start
+
+	if profile:
+		# Times of the kernel history are given in milliseconds
+		history = dr.kernel_history()
+		compile_time = sum(kernel.get("codegen_time", 0) + kernel.get("backend_time", 0) for kernel in history) / 1000
+		launch_time = sum(kernel.get("execution_time", 0) for kernel in history) / 1000
+
+		render_timings.append({
+			"total": total,
+			"trace": max(total - compile_time - launch_time, 0), # Python side tracing and everything else
+			"compile": compile_time,
+			"launch": launch_time,
+			"kernels": len(history)
+		})
+
+	return image
@@ -0,0 +1,121 @@
+import numpy as np
+import mitsuba as mi
+import hashlib
+import json
+import os
+import uuid
+
+from helpers.scene_helpers import scene_dependencies
+from helpers.render_helpers import traverse, param_value
+
+def hash_file(path: str, h=None):
+	h = hashlib.sha256() if h is None else h
+
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 24), b""):
+			h.update(chunk)
+
+	return h
+
+def hash_scene(scene_path: str, scene_args: dict = {}) -> str:
+	h = hashlib.sha256()
+	h.update(json.dumps({k: str(v) for k, v in scene_args.items()}, sort_keys=True).encode())
+
+	for path in scene_dependencies(scene_path, scene_args):
+		h.update(path.encode())
+
+		if os.path.exists(path):
+			hash_file(path, h)
+
+	return h.hexdigest()
+
+class RenderCache:
+	"""
+	On-disk cache of rendered images, keyed by the scene content, variant and everything that changes between
+	renders (transforms, polarizer angles, spp, integrator, film size). The least recently used entries are
+	evicted once the cache grows beyond max_size bytes.
+
+	In progressive mode, the spp are not part of the key. Instead, each entry stores the mean of all samples
+	rendered so far along with their count and seeds, so that rendering with more spp only adds the missing ones.
+	"""
+
+	def __init__(self, cache_dir: str, scene_path: str, scene_args: dict = {}, max_size: int = 50 * 1024**3, progressive: bool = False):
+		self.cache_dir = cache_dir
+		self.max_size = max_size
+		self.progressive = progressive
+		self.scene_hash = hash_scene(scene_path, scene_args)
+
+		os.makedirs(cache_dir, exist_ok=True)
+
+		self.size = sum(entry.stat().st_size for entry in self.entries())
+
+	def entries(self):
+		return [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".npz")]
+
+	def key(self, scene, spp, integrator=None) -> str:
+		params = traverse(scene)
+
+		if type(integrator) == type(None):
+			integrator = scene.integrator()
+
+		state = {
+			"scene": self.scene_hash,
+			"variant": mi.variant(),
+			"spp": None if self.progressive else spp,
+			"integrator": str(integrator),
+			"film": {k: param_value(params[k]).flatten().tolist() for k in params.keys() if k.startswith("sensor.film.")}, # Size and crop window
+			"params": {k: param_value(params[k]).flatten().tolist() for k in params.keys() if k.endswith("to_world") or k.endswith("theta.value")}
+		}
+
+		return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+	def path(self, key: str) -> str:
+		return os.path.join(self.cache_dir, key + ".npz")
+
+	def get_entry(self, key: str):
+		path = self.path(key)
+
+		try:
+			with np.load(path) as entry:
+				image = entry["image"]
+				meta = json.loads(str(entry["meta"]))
+		except (FileNotFoundError, ValueError, KeyError):
+			return None, {}
+
+		os.utime(path) # Mark as recently used
+
+		return image, meta
+
+	def get(self, key: str):
+		return self.get_entry(key)[0]
+
+	def put(self, key: str, image, meta: dict = {}) -> None:
+		path = self.path(key)
+		tmp_path = os.path.join(self.cache_dir, f".{uuid.uuid4().hex}.tmp")
+
+		# Image and metadata are stored in one file, so that they are replaced together
+		with open(tmp_path, "wb") as f:
+			np.savez(f, image=np.asarray(image, dtype=np.float32), meta=json.dumps(meta))
+
+		os.replace(tmp_path, path)
+
+		self.size += os.path.getsize(path)
+
+		if self.size > self.max_size:
+			self.evict()
+
+	def evict(self) -> None:
+		entries = sorted(self.entries(), key=lambda entry: entry.stat().st_mtime)
+		self.size = sum(entry.stat().st_size for entry in entries)
+
+		for entry in entries:
+			if self.size <= self.max_size:
+				break
+
+			size = entry.stat().st_size
+
+			try:
+				os.remove(entry.path)
+				self.size -= size
+			except FileNotFoundError:
+				pass
@@ -0,0 +1,168 @@
+import numpy as np
+import json
+import math
+import os
+
+from helpers.math_helpers import fov_to_focal, spherical_to_cartesian, view_matrix_inverse_batch, look_at_batch, look_at_center, camera_sequences
+from helpers.scene_helpers import flatten_scene, scene_defaults, substitute
+
+def camera_angles(camera_sequence: str, image_count: int) -> tuple[np.ndarray, np.ndarray]:
+	# Train views of the camera sequence, followed by a grid of 12 test views
+	thetas_train, phis_train = camera_sequences[camera_sequence](image_count)
+
+	thetas_0 = np.array([0.35*np.pi, 0.5*np.pi, 0.65*np.pi])
+	phis_0 = np.linspace(0, 2*np.pi, 4, endpoint=False)
+
+	thetas_test, phis_test = np.meshgrid(thetas_0, phis_0)
+
+	return np.concatenate([thetas_train, thetas_test.flatten()]), np.concatenate([phis_train, phis_test.flatten()])
+
+def x_fov(fov: float, fov_axis: str, width: int, height: int) -> float:
+	# Horizontal field of view in degrees, following Mitsuba's perspective sensor
+	aspect = width / height
+
+	if fov_axis == "smaller":
+		fov_axis = "y" if aspect > 1 else "x"
+	elif fov_axis == "larger":
+		fov_axis = "x" if aspect > 1 else "y"
+
+	if fov_axis == "y":
+		return np.rad2deg(2 * math.atan(math.tan(np.deg2rad(fov) / 2) * aspect))
+	elif fov_axis == "diagonal":
+		diagonal = 2 * math.tan(np.deg2rad(fov) / 2)
+		return np.rad2deg(2 * math.atan(diagonal / math.sqrt(1 + 1 / aspect**2) / 2))
+
+	return fov
+
+def parse_sensor(scene_path: str, args: dict = {}) -> dict:
+	# Film size, horizontal field of view and principal point offset of the first sensor of the scene XML
+	root = flatten_scene(scene_path, args)
+	args = {**scene_defaults(root), **args}
+
+	sensor = root.find(".//sensor")
+	assert sensor is not None, f"No sensor in {scene_path}"
+
+	def value(element, tag, name, default):
+		child = next((child for child in element if child.tag == tag and child.get("name") == name), None)
+		return default if child is None else substitute(child.get("value"), args)
+
+	film = sensor.find("film")
+	width = int(value(film, "integer", "width", 768)) if film is not None else 768
+	height = int(value(film, "integer", "height", 576)) if film is not None else 576
+
+	fov_axis = value(sensor, "string", "fov_axis", "x")
+	fov = value(sensor, "float", "fov", None)
+
+	if fov is None:
+		# 35mm equivalent focal length, which specifies the diagonal field of view
+		focal_length = float(value(sensor, "string", "focal_length", "50mm").replace("mm", ""))
+		fov, fov_axis = np.rad2deg(2 * math.atan(math.sqrt(36**2 + 24**2) / (2 * focal_length))), "diagonal"
+
+	return {
+		"width": width,
+		"height": height,
+		"x_fov": x_fov(float(fov), fov_axis, width, height),
+		"principal_point_offset": (float(value(sensor, "float", "principal_point_offset_x", 0)), float(value(sensor, "float", "principal_point_offset_y", 0)))
+	}
+
+class CameraRig:
+	"""
+	Train and test cameras on a sphere around the origin, looking at it, together with the intrinsics of the
+	scene's sensor. Builds the COLMAP poses.json written by generate_images.py and the Instant-NGP
+	transforms.json written by generate_transforms.py without Mitsuba.
+	"""
+
+	def __init__(self, width, height, x_fov, radius, thetas, phis, num_train_cams, camera_sequence="golden_spiral", principal_point_offset=(0.0, 0.0)):
+		self.width = width
+		self.height = height
+		self.x_fov = x_fov
+		self.radius = radius
+		self.thetas = thetas
+		self.phis = phis
+		self.num_train_cams = num_train_cams
+		self.camera_sequence = camera_sequence
+
+		self.focal_length = fov_to_focal(x_fov, width)
+		self.principal_point = (width / 2 + principal_point_offset[0], height / 2 + principal_point_offset[1])
+		self.positions = spherical_to_cartesian(radius, np.asarray(thetas), np.asarray(phis))
+
+	@staticmethod
+	def from_scene(scene_path, scene_args, radius, thetas, phis, num_train_cams, camera_sequence="golden_spiral"):
+		sensor = parse_sensor(scene_path, scene_args)
+
+		return CameraRig(sensor["width"], sensor["height"], sensor["x_fov"], radius, thetas, phis, num_train_cams, camera_sequence, sensor["principal_point_offset"])
+
+	def camera_matrix(self):
+		cam_matrix = np.identity(3)
+		cam_matrix[0, 0] = self.focal_length
+		cam_matrix[1, 1] = self.focal_length
+		cam_matrix[0, 2] = self.principal_point[0]
+		cam_matrix[1, 2] = self.principal_point[1]
+
+		return cam_matrix
+
+	def poses(self):
+		cam_matrix = self.camera_matrix().flatten().tolist()
+		cameras = []
+
+		view_matrices = view_matrix_inverse_batch(look_at_batch(self.positions, [0, 0, 0], [0, -1, 0])) # COLMAP expects Cam-to-World Transformation
+
+		for i, view_matrix in enumerate(view_matrices):
+			cam_obj = {}
+			cam_obj["camera_id"] = str(i).zfill(4) + ".png"
+			cam_obj["extrinsics"] = {"view_matrix": view_matrix.flatten().tolist()}
+			cam_obj["intrinsics"] = {"camera_matrix": cam_matrix, "resolution": [self.width, self.height]}
+			cam_obj["is_test_cam"] = (i >= self.num_train_cams)
+
+			cameras.append(cam_obj)
+
+		return {"camera_sequence": self.camera_sequence, "radius": self.radius, "cameras": cameras}
+
+	def write_poses(self, output_path):
+		# Write to a temporary file first, as several workers might output the poses at the same time
+		tmp_path = os.path.join(output_path, f"poses.json.{os.getpid()}.tmp")
+		with open(tmp_path, "w") as outfile:
+			json.dump(self.poses(), outfile, indent=2)
+		os.replace(tmp_path, os.path.join(output_path, "poses.json"))
+
+	def transforms(self, test=False):
+		# Instant-NGP transforms of the train (or test) cameras, without the per frame sharpness
+		indices = range(self.num_train_cams, len(self.positions)) if test else range(self.num_train_cams)
+
+		transforms = {}
+		transforms["w"] = self.width
+		transforms["h"] = self.height
+		transforms["fl_x"] = self.focal_length
+		transforms["fl_y"] = self.focal_length
+		transforms["cx"] = self.principal_point[0]
+		transforms["cy"] = self.principal_point[1]
+		transforms["k1"] = 0.0
+		transforms["k2"] = 0.0
+		transforms["p1"] = 0.0
+		transforms["p2"] = 0.0
+		transforms["camera_angle_x"] = math.atan(self.width / (2 * self.focal_length)) * 2
+		transforms["camera_angle_y"] = math.atan(self.height / (2 * self.focal_length)) * 2
+
+		transforms["aabb_scale"] = 1
+		transforms["frames"] = []
+
+		t2 = np.array([[0, 0, 1, 0], [1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]])
+
+		view_matrices = t2 @ look_at_batch(self.positions[indices], [0, 0, 0], [0, 1, 0])
+		view_matrices[:, :3, 0] *= -1
+		view_matrices[:, :3, 2] *= -1
+
+		for i, view_matrix in zip(indices, view_matrices):
+			camera = {}
+			camera["file_path"] = os.path.join("images", str(i).zfill(4) + ".png")
+			camera["transform_matrix"] = view_matrix
+
+			transforms["frames"].append(camera)
+
+		if len(view_matrices) > 0:
+			print(look_at_center(view_matrices[:, :3, 3], view_matrices[:, :3, 2])) # the cameras are looking at this point
+
+		for f in transforms["frames"]:
+			f["transform_matrix"] = f["transform_matrix"].tolist()
+
+		return transforms
@@ -1,50 +1,62 @@
 import numpy as np
 import cv2
 
-def view_matrix_inverse(view_matrix):
-	R = view_matrix[:3, :3]
-	T = view_matrix[:3, 3]
+def view_matrix_inverse_batch(view_matrices):
+	# Inverts rigid transforms of shape (..., 4, 4)
+	R_inv = np.swapaxes(view_matrices[..., :3, :3], -1, -2)
+	T_inv = -np.einsum("...ij,...j->...i", R_inv, view_matrices[..., :3, 3])
+
+	inverse = np.array(view_matrices, dtype=float)
+	inverse[..., :3, :3] = R_inv
+	inverse[..., :3, 3] = T_inv
 
-	R_inv = R.T
-	T_inv = -np.dot(R_inv, T)
+	return inverse
 
-	view_matrix[:3, :3] = R_inv
-	view_matrix[:3, 3] = T_inv
+def view_matrix_inverse(view_matrix):
+	view_matrix[...] = view_matrix_inverse_batch(view_matrix)
 
 	return view_matrix
 
 def fov_to_focal(fov, w):
 	return w / (2 * np.tan(np.deg2rad(fov) / 2))
 
+def rotmat2qvec_batch(R):
+	# Closed-form conversion of rotation matrices (..., 3, 3) to quaternions (..., 4) as (w, x, y, z). Each of the
+	# four candidate formulas divides by a different component, the one with the largest component is used.
+	Rxx, Rxy, Rxz = R[..., 0, 0], R[..., 0, 1], R[..., 0, 2]
+	Ryx, Ryy, Ryz = R[..., 1, 0], R[..., 1, 1], R[..., 1, 2]
+	Rzx, Rzy, Rzz = R[..., 2, 0], R[..., 2, 1], R[..., 2, 2]
+
+	diagonal = np.stack([Rxx + Ryy + Rzz, Rxx - Ryy - Rzz, Ryy - Rxx - Rzz, Rzz - Rxx - Ryy], axis=-1)
+	largest = np.sqrt(np.maximum(1 + diagonal, 1e-12)) / 2 # Dimensions: (..., 4)
+
+	w, x, y, z = [largest[..., i] for i in range(4)]
+	candidates = np.stack([
+		np.stack([w, (Rzy - Ryz) / (4 * w), (Rxz - Rzx) / (4 * w), (Ryx - Rxy) / (4 * w)], axis=-1),
+		np.stack([(Rzy - Ryz) / (4 * x), x, (Rxy + Ryx) / (4 * x), (Rxz + Rzx) / (4 * x)], axis=-1),
+		np.stack([(Rxz - Rzx) / (4 * y), (Rxy + Ryx) / (4 * y), y, (Ryz + Rzy) / (4 * y)], axis=-1),
+		np.stack([(Ryx - Rxy) / (4 * z), (Rxz + Rzx) / (4 * z), (Ryz + Rzy) / (4 * z), z], axis=-1)
+	], axis=-2) # Dimensions: (..., 4, 4)
+
+	qvec = np.take_along_axis(candidates, np.argmax(diagonal, axis=-1)[..., None, None], axis=-2)[..., 0, :]
+	qvec = qvec / np.linalg.norm(qvec, axis=-1, keepdims=True)
+
+	return np.where(qvec[..., :1] < 0, -qvec, qvec)
+
 def rotmat2qvec(R):
-	Rxx, Ryx, Rzx, Rxy, Ryy, Rzy, Rxz, Ryz, Rzz = R.flat
-	K = np.array([
-		[Rxx - Ryy - Rzz, 0, 0, 0],
-		[Ryx + Rxy, Ryy - Rxx - Rzz, 0, 0],
-		[Rzx + Rxz, Rzy + Ryz, Rzz - Rxx - Ryy, 0],
-		[Ryz - Rzy, Rzx - Rxz, Rxy - Ryx, Rxx + Ryy + Rzz]]) / 3.0
-	eigvals, eigvecs = np.linalg.eigh(K)
-	qvec = eigvecs[[3, 0, 1, 2], np.argmax(eigvals)]
-	if qvec[0] < 0:
-		qvec *= -1
-	return qvec
+	return rotmat2qvec_batch(np.asarray(R))
+
+def qvec2rotmat_batch(qvec):
+	w, x, y, z = [qvec[..., i] for i in range(4)]
+
+	return np.stack([
+		np.stack([1 - 2 * y**2 - 2 * z**2, 2 * x * y - 2 * w * z, 2 * z * x + 2 * w * y], axis=-1),
+		np.stack([2 * x * y + 2 * w * z, 1 - 2 * x**2 - 2 * z**2, 2 * y * z - 2 * w * x], axis=-1),
+		np.stack([2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x**2 - 2 * y**2], axis=-1)
+	], axis=-2) # Dimensions: (..., 3, 3)
 
 def qvec2rotmat(qvec):
-	return np.array([
-		[
-			1 - 2 * qvec[2]**2 - 2 * qvec[3]**2,
-			2 * qvec[1] * qvec[2] - 2 * qvec[0] * qvec[3],
-			2 * qvec[3] * qvec[1] + 2 * qvec[0] * qvec[2]
-		], [
-			2 * qvec[1] * qvec[2] + 2 * qvec[0] * qvec[3],
-			1 - 2 * qvec[1]**2 - 2 * qvec[3]**2,
-			2 * qvec[2] * qvec[3] - 2 * qvec[0] * qvec[1]
-		], [
-			2 * qvec[3] * qvec[1] - 2 * qvec[0] * qvec[2],
-			2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
-			1 - 2 * qvec[1]**2 - 2 * qvec[2]**2
-		]
-	])
+	return qvec2rotmat_batch(np.asarray(qvec))
 
 def rotmat(a, b):
 	a, b = a / np.linalg.norm(a), b / np.linalg.norm(b)
@@ -66,6 +78,48 @@ def golden_spiral(samples):
 
 	return thetas, phis
 
+# R2 low-discrepancy sequence (Roberts 2018) mapped to the sphere with an equal-area mapping.
+# Unlike golden_spiral, the first N samples do not depend on the total number of samples.
+def r2_sphere(samples):
+	g = 1.32471795724474602596 # Plastic number
+	indices = np.arange(0, samples, dtype=float)
+
+	u = (0.5 + indices / g) % 1
+	v = (0.5 + indices / g**2) % 1
+
+	thetas = np.arccos(1 - 2 * u)
+	phis = 2 * np.pi * v
+
+	return thetas, phis
+
+camera_sequences = {
+	"golden_spiral": golden_spiral,
+	"r2": r2_sphere
+}
+
+# numpy version of mi.ScalarTransform4f().look_at() for origins, targets and up vectors of shape (..., 3),
+# columns are (left, up, direction, origin)
+def look_at_batch(origins, targets, ups):
+	origins, targets, ups = np.broadcast_arrays(np.asarray(origins, dtype=float), np.asarray(targets, dtype=float), np.asarray(ups, dtype=float))
+
+	directions = targets - origins
+	directions = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+	left = np.cross(ups, directions)
+	left = left / np.linalg.norm(left, axis=-1, keepdims=True)
+	new_up = np.cross(directions, left)
+
+	matrices = np.zeros(origins.shape[:-1] + (4, 4))
+	matrices[..., :3, 0] = left
+	matrices[..., :3, 1] = new_up
+	matrices[..., :3, 2] = directions
+	matrices[..., :3, 3] = origins
+	matrices[..., 3, 3] = 1
+
+	return matrices
+
+def look_at(origin, target, up):
+	return look_at_batch(origin, target, up)
+
 def spherical_to_cartesian(radius, theta, phi):
 	x = radius * np.sin(theta) * np.sin(phi)
 	y = radius * np.cos(theta)
@@ -94,4 +148,37 @@ def closest_point_2_lines(oa, da, ob, db): # returns point closest to both rays
 		ta = 0
 	if tb > 0:
 		tb = 0
-	return (oa+ta*da+ob+tb*db) * 0.5, denom
\ No newline at end of file
+	return (oa+ta*da+ob+tb*db) * 0.5, denom
+
+def look_at_center(origins, directions, block_size=1024):
+	# Weighted mean of closest_point_2_lines over all pairs of camera rays, computed for blocks of rows at once.
+	# Returns the point the cameras are looking at.
+	directions = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+	origin_dots = np.sum(origins * directions, axis=-1) # o_i . d_i
+
+	total_point = np.zeros(3)
+	total_weight = 0.0
+
+	for start in range(0, len(origins), block_size):
+		oa, da = origins[start:start + block_size], directions[start:start + block_size]
+
+		# With unit directions and c = da x db, the determinants reduce to dot products:
+		# det([t, db, c]) = t.da - (t.db)(da.db), det([t, da, c]) = (t.da)(da.db) - t.db and |c|^2 = 1 - (da.db)^2
+		cos = da @ directions.T # Dimensions: (B, N)
+		t_da = directions[start:start + block_size] @ origins.T - origin_dots[start:start + block_size, None]
+		t_db = origin_dots[None, :] - oa @ directions.T
+
+		denom = np.maximum(1 - cos**2, 0)
+		ta = np.minimum((t_da - t_db * cos) / (denom + 1e-10), 0)
+		tb = np.minimum((t_da * cos - t_db) / (denom + 1e-10), 0)
+
+		weights = np.where(denom > 0.00001, denom, 0)
+
+		# Sum of the weighted midpoints (oa + ta*da + ob + tb*db) / 2 over the pairs of the block
+		total_point += 0.5 * (np.sum(weights, axis=1) @ oa + np.sum(weights * ta, axis=1) @ da + np.sum(weights, axis=0) @ origins + np.sum(weights * tb, axis=0) @ directions)
+		total_weight += np.sum(weights)
+
+	if total_weight > 0.0:
+		total_point /= total_weight
+
+	return total_point
@@ -16,4 +16,17 @@ def separate_2(img_0, img_90):
 	return indirect, direct
 
 def reconstruct(indirect, direct):
-	return indirect + direct
\ No newline at end of file
+	return indirect + direct
+
+def analyzer_images(stokes, angles, offset=90):
+	# Intensity behind an ideal linear polarizer, computed from the Stokes components (S0, S1, S2, S3).
+	# The camera polarizer is rotated by 90 degrees around the view axis, which is reflected by offset.
+	s0, s1, s2 = stokes[0], stokes[1], stokes[2]
+
+	images = []
+
+	for angle in angles:
+		alpha = 2 * np.deg2rad(angle + offset)
+		images.append(0.5 * (s0 + np.cos(alpha) * s1 + np.sin(alpha) * s2))
+
+	return np.stack(images) # Dimensions: (A, W, H, 3)
\ No newline at end of file
@@ -0,0 +1,145 @@
+import os
+import socket
+import time
+import uuid
+
+class LeaseQueue:
+	"""
+	File based work queue for rendering the views of a dataset with several workers, possibly on different nodes
+	sharing a filesystem. A view is claimed by atomically creating its lease file and marked as done once all of
+	its images have been written. Leases that have not been renewed for lease_timeout seconds are taken over by
+	other workers, leases of the same worker_id are reclaimed immediately (e.g. after a crash). The default
+	worker_id is the hostname and slot, so a restarted worker resumes the views of the one it replaces, while
+	several workers on the same node need different slots.
+	"""
+
+	def __init__(self, queue_dir: str, worker_id: str = "", lease_timeout: float = 3600, slot: int = 0):
+		self.queue_dir = queue_dir
+		self.worker_id = worker_id if worker_id != "" else f"{socket.gethostname()}-{slot}"
+		self.lease_timeout = lease_timeout
+
+		os.makedirs(queue_dir, exist_ok=True)
+
+	def lease_path(self, index: int) -> str:
+		return os.path.join(self.queue_dir, str(index).zfill(4) + ".lease")
+
+	def done_path(self, index: int) -> str:
+		return os.path.join(self.queue_dir, str(index).zfill(4) + ".done")
+
+	def is_done(self, index: int) -> bool:
+		return os.path.exists(self.done_path(index))
+
+	def lease_owner(self, index: int) -> str:
+		state = self.lease_state(index)
+		return "" if type(state) == type(None) else state[0]
+
+	def lease_state(self, index: int):
+		# Owner and modification time (ns) of the lease, or None if the view is not leased
+		try:
+			with open(self.lease_path(index), "r") as f:
+				return f.read().strip(), os.fstat(f.fileno()).st_mtime_ns
+		except FileNotFoundError:
+			return None
+
+	def break_lease(self, index: int, owner: str, mtime_ns=None) -> bool:
+		# Moves the lease out of the way and only deletes it if it is still the one that was checked (same owner and
+		# mtime). Another worker might have broken it and claimed the view in the meantime, then its lease is put back.
+		moved_path = self.lease_path(index) + "." + uuid.uuid4().hex + ".stale"
+
+		try:
+			os.rename(self.lease_path(index), moved_path)
+		except FileNotFoundError:
+			return False
+
+		with open(moved_path, "r") as f:
+			moved_owner, moved_mtime_ns = f.read().strip(), os.fstat(f.fileno()).st_mtime_ns
+
+		if moved_owner == owner and (type(mtime_ns) == type(None) or moved_mtime_ns == mtime_ns):
+			os.remove(moved_path)
+			return True
+
+		try:
+			# Unlike rename, link does not replace a lease that was created since
+			os.link(moved_path, self.lease_path(index))
+		except FileExistsError:
+			pass
+
+		os.remove(moved_path)
+
+		return False
+
+	def claim(self, index: int) -> bool:
+		if self.is_done(index):
+			return False
+
+		try:
+			fd = os.open(self.lease_path(index), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except FileExistsError:
+			state = self.lease_state(index)
+
+			if type(state) == type(None):
+				return self.claim(index)
+
+			owner, mtime_ns = state
+			age = time.time() - mtime_ns / 1e9
+
+			if owner != self.worker_id and age < self.lease_timeout:
+				return False
+
+			if not self.break_lease(index, owner, mtime_ns):
+				return False
+
+			return self.claim(index)
+
+		with os.fdopen(fd, "w") as f:
+			f.write(self.worker_id)
+
+		# The lease is only ours if it still holds our id when read back
+		if self.lease_owner(index) != self.worker_id:
+			return False
+
+		# Another worker might have finished the view in the meantime
+		if self.is_done(index):
+			self.release(index)
+			return False
+
+		return True
+
+	def renew(self, index: int) -> None:
+		# A lease that was taken over by another worker is not extended
+		if self.lease_owner(index) == self.worker_id:
+			os.utime(self.lease_path(index))
+
+	def release(self, index: int) -> None:
+		# Only removes the lease if it belongs to this worker
+		self.break_lease(index, self.worker_id)
+
+	def mark_done(self, index: int) -> None:
+		with open(self.done_path(index), "w") as f:
+			f.write(self.worker_id)
+
+		self.release(index)
+
+	def remaining(self, count: int) -> list[int]:
+		return [i for i in range(count) if not self.is_done(i)]
+
+	def claims(self, count: int):
+		# Yields claimed view indices until no view is left that can be claimed by this worker
+		for index in self.remaining(count):
+			if self.claim(index):
+				yield index
+
+		self.report_leased(count)
+
+	def report_leased(self, count: int) -> None:
+		# Views of other workers that are not done yet, which this worker will not render
+		leased = []
+
+		for index in self.remaining(count):
+			state = self.lease_state(index)
+
+			if type(state) != type(None) and state[0] != self.worker_id:
+				leased.append(f"{index} ({state[0]}, renewed {time.time() - state[1] / 1e9:.0f}s ago)")
+
+		if len(leased) > 0:
+			print(f"Not rendered by {self.worker_id}, still leased by other workers ({len(leased)}): {', '.join(leased)}")
@@ -1,44 +1,532 @@
 import numpy as np
 import mitsuba as mi
+import drjit as dr
+import time
+import re
 from tqdm import tqdm
+from contextlib import contextmanager
 
 from helpers.math_helpers import *
+from helpers.polarization_helpers import analyzer_images
+from helpers.backend_helpers import timed_render, render_timings, available_memory, render_memory_budget
 
-def render_np(scene, spp, integrator=None):
-	if type(integrator) == type(None):
-		return mi.render(scene, spp=spp).numpy()
-	else:
-		return mi.render(scene, spp=spp, integrator=integrator).numpy()
+# One traversed SceneParameters per scene along with the values last set through update_params
+scene_parameters = {}
+
+def param_value(value):
+	if hasattr(value, "matrix"):
+		value = value.matrix
+
+	return np.array(value, dtype=np.float64)
+
+def traverse(scene):
+	entry = scene_parameters.get(id(scene))
+
+	if type(entry) == type(None) or entry[0] is not scene:
+		start = time.perf_counter()
+		entry = (scene, mi.traverse(scene), {})
+		scene_parameters[id(scene)] = entry
+		print(f"Traversed scene in {time.perf_counter() - start:.2f}s")
+
+	return entry[1]
+
+def update_params(scene, values):
+	# Only sets the parameters whose value changed since the last update, and skips the update if none did
+	params = traverse(scene)
+	last_values = scene_parameters[id(scene)][2]
+
+	changed = False
+
+	for key, value in values.items():
+		value_np = param_value(value)
+
+		if key in last_values and np.array_equal(last_values[key], value_np):
+			continue
+
+		params[key] = value
+		last_values[key] = value_np
+		changed = True
+
+	if changed:
+		params.update()
+
+class SceneSession:
+	"""
+	Loads a scene once per set of load arguments and reports how long loading and traversing took. All
+	parameter changes go through update_params, which reuses one SceneParameters per scene.
+	"""
+
+	def __init__(self, scene_path, **scene_args):
+		self.scene_path = scene_path
+		self.scene_args = scene_args
+		self.scenes = {}
+
+	def load(self, **args):
+		key = tuple(sorted(args.items()))
+
+		if key not in self.scenes:
+			start = time.perf_counter()
+			self.scenes[key] = mi.load_file(self.scene_path, **self.scene_args, **args)
+			print(f"Loaded {self.scene_path} {args} in {time.perf_counter() - start:.2f}s")
+
+			traverse(self.scenes[key])
+
+		return self.scenes[key]
+
+def mi_render_np(scene, spp, integrator=None, seed=0):
+	max_memory = render_memory_budget()
+
+	if type(max_memory) != type(None):
+		_, _, width, height = film_crop(scene)
+		tile_size = tile_size_for(spp, max_memory)
+
+		if tile_size < max(width, height):
+			return render_tiled_np(scene, spp, integrator, seed, tile_size)
+
+	return timed_render(scene, spp, integrator, seed)
+
+def tile_size_for(spp, max_memory, bytes_per_sample=64):
+	# Side length of square tiles whose samples fit into max_memory bytes, with the same rough estimate of the
+	# wavefront state per sample as auto_batch_size
+	return max(16, int(np.sqrt(max_memory / (spp * bytes_per_sample))))
+
+def film_crop(scene):
+	params = traverse(scene)
+	offset, size = params["sensor.film.crop_offset"], params["sensor.film.crop_size"]
+
+	return (int(offset[0]), int(offset[1]), int(size[0]), int(size[1]))
+
+def render_tiled_np(scene, spp, integrator=None, seed=0, tile_size=256):
+	# Renders the current crop window in tiles through their own crop windows and streams them into a
+	# preallocated output
+	x0, y0, width, height = film_crop(scene)
+
+	tiles = [(x, y, min(tile_size, x0 + width - x), min(tile_size, y0 + height - y)) for y in range(y0, y0 + height, tile_size) for x in range(x0, x0 + width, tile_size)]
+	output = None
+
+	with cropped(scene, (x0, y0, width, height)):
+		for t, (x, y, w, h) in enumerate(tqdm(tiles, desc="Tiles", leave=False)):
+			update_params(scene, {
+				"sensor.film.crop_offset": mi.ScalarPoint2u(x, y),
+				"sensor.film.crop_size": mi.ScalarVector2u(w, h)
+			})
+
+			# Every tile needs its own seed, otherwise all tiles repeat the same noise pattern
+			tile = timed_render(scene, spp, integrator, seed * len(tiles) + t)
+
+			if type(output) == type(None):
+				output = np.empty((height, width, tile.shape[-1]), dtype=np.float32)
+
+			output[y - y0:y - y0 + h, x - x0:x - x0 + w] = tile
+
+	return output
+
+def render_np(scene, spp, integrator=None, cache=None, seed=0, sampler=None):
+	if type(sampler) != type(None):
+		return sampler.render(scene, spp, integrator)
+
+	if type(cache) != type(None):
+		key = cache.key(scene, spp, integrator)
+		image, meta = cache.get_entry(key)
+
+		if type(image) != type(None) and cache.progressive:
+			return accumulate_np(scene, spp, integrator, cache, key, image, meta)
+		elif type(image) != type(None):
+			return image
+
+	image = mi_render_np(scene, spp, integrator, seed)
+
+	if type(cache) != type(None):
+		cache.put(key, image, {"spp": spp, "seeds": [seed]})
+
+	return image
+
+def accumulate_np(scene, spp, integrator, cache, key, image, meta):
+	# Only renders the samples missing from the accumulation buffer, with a seed that has not been used yet
+	rendered_spp = meta["spp"]
+
+	if rendered_spp >= spp:
+		return image
+
+	seed = max(meta["seeds"]) + 1
+	extra_spp = spp - rendered_spp
+
+	extra = mi_render_np(scene, extra_spp, integrator, seed)
+
+	image = (image.astype(np.float64) * rendered_spp + extra.astype(np.float64) * extra_spp) / spp
+	image = image.astype(np.float32)
+
+	cache.put(key, image, {"spp": spp, "seeds": meta["seeds"] + [seed]})
+
+	return image
+
+class AdaptiveSampler:
+	"""
+	Renders in passes of pass_spp samples until the estimated relative error inside the mask drops below
+	target_error, the requested spp are reached or time_budget seconds have passed. The error is estimated
+	from the variance between passes as RMS standard error over the mean intensity of the masked pixels,
+	which is too unreliable to stop on before min_passes passes. Passes are seeded per view_index, so views
+	don't share noise. The spp and error of each render are appended to history.
+	"""
+
+	def __init__(self, target_error=0.01, time_budget=None, pass_spp=16, min_passes=4):
+		self.target_error = target_error
+		self.time_budget = time_budget
+		self.pass_spp = pass_spp
+		self.min_passes = min_passes
+		self.view_index = 0
+		self.mask = None
+		self.history = []
+
+	def relative_error(self, mean, m2, passes):
+		# Only the intensity channels are used, e.g. the Stokes components are skipped
+		mean, m2 = mean[..., :3], m2[..., :3]
+
+		if type(self.mask) != type(None):
+			mean, m2 = mean[self.mask > 0], m2[self.mask > 0]
+
+		std_error = np.sqrt(np.mean(m2 / (passes - 1) / passes))
+
+		return std_error / max(np.mean(mean), 1e-8)
+
+	def render(self, scene, spp, integrator=None):
+		start = time.perf_counter()
+		max_passes = max(1, spp // self.pass_spp)
+
+		mean = None
+		error = float("inf")
+
+		# Welford's algorithm over the pass images
+		for passes in range(1, max_passes + 1):
+			image = mi_render_np(scene, self.pass_spp, integrator, seed=self.view_index * max_passes + passes - 1).astype(np.float64)
+
+			if passes == 1:
+				mean = image
+				m2 = np.zeros_like(image)
+			else:
+				delta = image - mean
+				mean += delta / passes
+				m2 += delta * (image - mean)
+
+				error = self.relative_error(mean, m2, passes)
+
+				if passes >= self.min_passes and error <= self.target_error:
+					break
+
+			if type(self.time_budget) != type(None) and time.perf_counter() - start >= self.time_budget:
+				break
+
+		self.history.append({"spp": passes * self.pass_spp, "error": float(error) if passes > 1 else None})
+
+		return mean.astype(np.float32)
+
+def stokes_integrator(scene):
+	return mi.load_dict({
+		"type": "stokes",
+		"nested": scene.integrator()
+	})
+
+def render_stokes_np(scene, spp, integrator, cache=None, sampler=None):
+	return stokes_channels(render_np(scene, spp, integrator, cache, sampler=sampler), integrator)
+
+def stokes_channels(image, integrator):
+	# The Stokes components are appended after the nested integrator's channels as S0.R, S0.G, S0.B, S1.R, ...
+	stokes = image[..., -len(integrator.aov_names()):]
+	stokes = stokes.reshape(*stokes.shape[:-1], 4, 3)
+
+	return np.moveaxis(stokes, -2, 0) # Dimensions: (4, W, H, 3)
+
+def auto_batch_size(width, height, spp, bytes_per_sample=64, memory_fraction=0.5):
+	# Number of views per launch that fits into the memory budget (or a fraction of the free memory), with a
+	# rough estimate of the wavefront state per sample. Mitsuba's wavefront size is additionally limited to 2^32 samples.
+	max_memory = render_memory_budget()
+
+	if type(max_memory) == type(None):
+		max_memory = available_memory() * memory_fraction
+
+	bytes_per_view = width * height * spp * bytes_per_sample
+	batch_size = int(max_memory // bytes_per_view)
+
+	return max(1, min(batch_size, (2**32 - 1) // (width * height * spp)))
+
+def batch_sensor(scene, to_worlds, spp):
+	# Renders the views of all to_worlds side by side into one film of width K * W, with the projection and film
+	# settings of the scene's sensor
+	params = traverse(scene)
+	scene_sensor = scene.sensors()[0]
+	film = scene_sensor.film()
+	width, height = params["sensor.film.size"]
+
+	sensor = {
+		"type": "batch",
+		"film": {"type": "hdrfilm", "width": width * len(to_worlds), "height": height, "rfilter": film.rfilter(), "sample_border": film.sample_border(), **film_pixel_format(film)},
+		"sampler": {"type": "independent", "sample_count": spp}
+	}
+
+	projection = {"fov": params["sensor.x_fov"][0], "fov_axis": "x", "near_clip": scene_sensor.near_clip(), "far_clip": scene_sensor.far_clip()}
+
+	for axis in ["x", "y"]:
+		if f"sensor.principal_point_offset_{axis}" in params:
+			projection[f"principal_point_offset_{axis}"] = params[f"sensor.principal_point_offset_{axis}"][0]
+
+	for k, to_world in enumerate(to_worlds):
+		sensor[f"sensor_{k}"] = {"type": "perspective", **projection, "to_world": to_world}
+
+	return mi.load_dict(sensor)
+
+def film_pixel_format(film):
+	# The pixel format is neither a parameter nor exposed by the film, only part of its description
+	match = re.search(r"pixel_format = (\w+)", str(film))
+
+	if type(match) == type(None):
+		return {}
+
+	return {"pixel_format": {"y": "luminance", "ya": "luminance_alpha"}.get(match[1], match[1])}
+
+def render_batch_np(scene, radius, thetas, phis, spp, integrator=None, seed=0):
+	to_worlds = [mi.ScalarTransform4f().look_at(origin=spherical_to_cartesian(radius, theta, phi), target=[0, 0, 0], up=[0, 1, 0]) for theta, phi in zip(thetas, phis)]
+
+	image = timed_render(scene, spp, integrator, seed, sensor=batch_sensor(scene, to_worlds, spp))
+
+	H, KW, C = image.shape
+	K = len(to_worlds)
+
+	return np.moveaxis(image.reshape(H, K, KW // K, C), 1, 0) # Dimensions: (K, H, W, C)
+
+def iter_render_batches(scene, radius, thetas, phis, polarized=True, spp=512, integrator=None, angles=(0, 90), stokes=False, batch_size=0):
+	# Renders batch_size views per launch (0 picks it from the free memory) and yields them one by one.
+	# A single polarizer can't be in front of all cameras at once, so polarized views need Stokes rendering,
+	# whose Stokes vectors are then rotated into the frame of each view.
+	assert not polarized or stokes, "Batched polarized rendering requires --stokes"
+
+	if batch_size == 0:
+		width, height = traverse(scene)["sensor.film.size"]
+		batch_size = auto_batch_size(width, height, spp)
+
+	if polarized and type(integrator) == type(None):
+		integrator = stokes_integrator(scene)
+
+	for start in range(0, len(thetas), batch_size):
+		batch_thetas, batch_phis = thetas[start:start + batch_size], phis[start:start + batch_size]
+
+		if polarized:
+			update_params(scene, {"polarizer_cam.to_world": mi.ScalarTransform4f().translate([0, 10000, 0])})
+
+		images = render_batch_np(scene, radius, batch_thetas, batch_phis, spp, integrator)
+
+		if not polarized:
+			for image in images:
+				yield image[None, ...] # Dimensions: (1, W, H, 3)
+			continue
+
+		# The stokes integrator aligns the Stokes vectors with the scene's sensor instead of the batch views
+		reference_to_world = param_value(scene.sensors()[0].world_transform()).reshape(4, 4)
+		to_worlds = look_at_batch(spherical_to_cartesian(radius, np.asarray(batch_thetas), np.asarray(batch_phis)), [0, 0, 0], [0, 1, 0])
+
+		for image, to_world in zip(images, to_worlds):
+			stokes = rotate_stokes_basis(stokes_channels(image, integrator), reference_to_world, to_world, traverse(scene)["sensor.x_fov"][0])
+
+			yield analyzer_images(stokes, angles) # Dimensions: (A, W, H, 3)
+
+def rotate_stokes_basis(stokes, reference_to_world, to_world, x_fov):
+	# The stokes integrator expresses the Stokes vector of a ray with direction d in the basis cross(d, up) of the
+	# scene sensor's up vector. Rotates S1 and S2 per pixel into the basis of the view's own up vector, with the
+	# same signed angle as Mitsuba's mueller::rotate_stokes_basis. Uses the pixel center directions.
+	_, height, width, _ = stokes.shape
+
+	directions = primary_ray_directions(width, height, x_fov)[:, :, 0] @ to_world[:3, :3].T
+	current_basis = np.cross(directions, reference_to_world[:3, 1])
+	target_basis = np.cross(directions, to_world[:3, 1])
+
+	# Both bases are orthogonal to the propagation direction -d, so this is the signed angle around it
+	angle = np.arctan2(np.sum(np.cross(current_basis, target_basis) * -directions, axis=-1), np.sum(current_basis * target_basis, axis=-1))
+	sin, cos = np.sin(2 * angle)[..., None], np.cos(2 * angle)[..., None]
+
+	s0, s1, s2, s3 = stokes
+
+	return np.stack([s0, cos * s1 + sin * s2, -sin * s1 + cos * s2, s3]) # Dimensions: (4, W, H, 3)
+
+def render_from_angle(scene, radius, theta, phi, polarized=True, spp=512, integrator=None, angles=(0, 90), stokes=False, cache=None, sampler=None, crop=None):
+	if type(crop) != type(None):
+		width, height = traverse(scene)["sensor.film.size"]
+
+		with cropped(scene, crop):
+			images = render_from_angle(scene, radius, theta, phi, polarized, spp, integrator, angles, stokes, cache, sampler)
+
+		return paste_crop(images, crop, width, height)
 
-def render_from_angle(scene, radius, theta, phi, polarized=True, spp=512, integrator=None):
 	cam_pos = spherical_to_cartesian(radius, theta, phi)
 	polarizer_pos = spherical_to_cartesian(radius - 0.1, theta, phi)
 
-	params = mi.traverse(scene)
-	params["sensor.to_world"] = mi.ScalarTransform4f().look_at(origin=cam_pos, target=[0, 0, 0], up=[0, 1, 0])
+	values = {}
+	values["sensor.to_world"] = mi.ScalarTransform4f().look_at(origin=cam_pos, target=[0, 0, 0], up=[0, 1, 0])
 
-	if polarized:
-		params["polarizer_cam.to_world"] = mi.ScalarTransform4f().look_at(origin=polarizer_pos, target=[0, 0, 0], up=[0, 1, 0]).rotate(axis=[0, 0, 1], angle=90)
-		params["polarizer_cam.bsdf.theta.value"] = 0 # Make sure the polarizer angle is 0 (might have been altered by previous executions)
+	if polarized and stokes:
+		# The analyzer is applied afterwards, so the camera polarizer must not be in the way
+		values["polarizer_cam.to_world"] = mi.ScalarTransform4f().translate([0, 10000, 0])
+	elif polarized:
+		values["polarizer_cam.to_world"] = mi.ScalarTransform4f().look_at(origin=polarizer_pos, target=[0, 0, 0], up=[0, 1, 0]).rotate(axis=[0, 0, 1], angle=90)
 
-	params.update()
+	update_params(scene, values)
 
-	if polarized:
-		img_0 = render_np(scene, spp, integrator)
+	if polarized and stokes:
+		if type(integrator) == type(None):
+			integrator = stokes_integrator(scene)
 
-		params["polarizer_cam.bsdf.theta.value"] = 90
-		params.update()
+		return analyzer_images(render_stokes_np(scene, spp, integrator, cache, sampler), angles) # Dimensions: (A, W, H, 3)
+	elif polarized:
+		images = []
+
+		for angle in angles:
+			update_params(scene, {"polarizer_cam.bsdf.theta.value": angle})
 
-		img_90 = render_np(scene, spp, integrator)
+			images.append(render_np(scene, spp, integrator, cache, sampler=sampler))
 
-		return np.stack((img_0, img_90)) # Dimensions: (2, W, H, 3)
+		return np.stack(images) # Dimensions: (A, W, H, 3)
 	else:
-		return render_np(scene, spp, integrator)[None, ...] # Dimensions: (1, W, H, 3)
+		return render_np(scene, spp, integrator, cache, sampler=sampler)[None, ...] # Dimensions: (1, W, H, 3)
 	
-def render_from_angles(scene, radius, thetas, phis, polarized=True, spp=512, integrator=None):
-	images = []
+def iter_render_from_angles(scene, radius, thetas, phis, polarized=True, spp=512, integrator=None, angles=(0, 90), stokes=False, cache=None, batch_size=1):
+	if batch_size != 1:
+		assert type(cache) == type(None), "Batched rendering does not support caching"
+
+		yield from tqdm(iter_render_batches(scene, radius, thetas, phis, polarized, spp, integrator, angles, stokes, batch_size), desc="Rendering", total=len(thetas))
+		return
 
 	for theta, phi in tqdm(zip(thetas, phis), desc="Rendering", total=len(thetas)):
-		images.append(render_from_angle(scene, radius, theta, phi, polarized, spp, integrator))
+		yield render_from_angle(scene, radius, theta, phi, polarized, spp, integrator, angles, stokes, cache)
+
+def render_from_angles(scene, radius, thetas, phis, polarized=True, spp=512, integrator=None, angles=(0, 90), stokes=False, cache=None, batch_size=1):
+	images = list(iter_render_from_angles(scene, radius, thetas, phis, polarized, spp, integrator, angles, stokes, cache, batch_size))
+
+	return np.stack(images) # Dimensions: (N, 1, W, H, 3) or (N, A, W, H, 3)
+
+def primary_ray_directions(width, height, x_fov, spp=1, seed=0):
+	# Camera space directions following Mitsuba's perspective sensor (+x points left, +y up, +z forward)
+	if spp == 1:
+		offsets = np.full((1, 2), 0.5) # Pixel centers
+	else:
+		offsets = np.random.default_rng(seed).random((spp, 2))
+
+	x = (np.arange(width)[None, :, None] + offsets[:, 0]) / width
+	y = (np.arange(height)[:, None, None] + offsets[:, 1]) / height
+
+	tan_fov = np.tan(np.deg2rad(x_fov) / 2)
+	dx, dy, dz = np.broadcast_arrays((1 - 2 * x) * tan_fov, (1 - 2 * y) * tan_fov * height / width, 1.0)
+
+	directions = np.stack([dx, dy, dz], axis=-1)
+
+	directions = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+	return directions.astype(np.float32) # Dimensions: (H, W, S, 3)
+
+def ray_cast_coverage(scene, origins, directions, shape_ids, max_depth=4):
+	# Fraction of rays per pixel whose closest hit (ignoring all shapes not in shape_ids) is one of shape_ids
+	shapes = [mi.ShapePtr(shape) for shape in scene.shapes() if shape.id() in shape_ids]
+
+	K, H, W, S, _ = directions.shape
+	origins = np.broadcast_to(origins[:, None, None, None, :], directions.shape).reshape(-1, 3)
+	directions = directions.reshape(-1, 3)
+
+	ray = mi.Ray3f(
+		o=mi.Point3f(*[mi.Float(np.ascontiguousarray(origins[:, i], dtype=np.float32)) for i in range(3)]),
+		d=mi.Vector3f(*[mi.Float(np.ascontiguousarray(directions[:, i], dtype=np.float32)) for i in range(3)])
+	)
+
+	hit = dr.zeros(mi.Bool, K * H * W * S)
+	active = dr.ones(mi.Bool, K * H * W * S)
+
+	# Shapes like the polarizers or the light sphere are stepped through instead of moving them away
+	for _ in range(max_depth):
+		si = scene.ray_intersect(ray, active=active)
+
+		is_target = dr.zeros(mi.Bool, K * H * W * S)
+		for shape in shapes:
+			is_target |= si.shape == shape
+		is_target &= si.is_valid()
+
+		hit |= active & is_target
+		active &= si.is_valid() & ~is_target
+
+		if not dr.any(active):
+			break
+
+		ray = si.spawn_ray(ray.d)
+
+	return hit.numpy().reshape(K, H, W, S).mean(axis=-1) # Dimensions: (K, H, W)
+
+def iter_ray_cast_masks(scene, radius, thetas, phis, shape_ids=("head", "hair"), spp=1, max_rays=2**24):
+	params = traverse(scene)
+
+	width, height = params["sensor.film.size"]
+	directions = primary_ray_directions(width, height, params["sensor.x_fov"][0], spp)
+
+	# Trace the rays of as many views as fit into max_rays at once
+	batch_size = max(1, max_rays // directions[..., 0].size)
+
+	for start in range(0, len(thetas), batch_size):
+		to_worlds = look_at_batch(spherical_to_cartesian(radius, thetas[start:start + batch_size], phis[start:start + batch_size]), [0, 0, 0], [0, 1, 0])
+
+		origins = to_worlds[:, :3, 3]
+		world_directions = np.einsum("kij,hwsj->khwsi", to_worlds[:, :3, :3].astype(np.float32), directions)
+
+		yield from ray_cast_coverage(scene, origins, world_directions, shape_ids)
+
+def ray_cast_masks(scene, radius, thetas, phis, shape_ids=("head", "hair"), spp=1, max_rays=2**24):
+	return np.stack(list(iter_ray_cast_masks(scene, radius, thetas, phis, shape_ids, spp, max_rays))) # Dimensions: (N, H, W)
+
+def mask_crop(mask, padding=2):
+	# Crop window (offset x, offset y, width, height) around all pixels covered by the mask
+	rows = np.flatnonzero(np.any(mask > 0, axis=1))
+	cols = np.flatnonzero(np.any(mask > 0, axis=0))
+
+	if len(rows) == 0:
+		return (0, 0, 1, 1)
+
+	height, width = mask.shape
+
+	x0, x1 = max(cols[0] - padding, 0), min(cols[-1] + 1 + padding, width)
+	y0, y1 = max(rows[0] - padding, 0), min(rows[-1] + 1 + padding, height)
+
+	return (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+
+def paste_crop(images, crop, width, height):
+	x, y, w, h = crop
+
+	canvas = np.zeros(images.shape[:-3] + (height, width, images.shape[-1]), dtype=images.dtype)
+	canvas[..., y:y + h, x:x + w, :] = images
+
+	return canvas
+
+@contextmanager
+def cropped(scene, crop):
+	x, y, width, height = film_crop(scene)
+
+	update_params(scene, {
+		"sensor.film.crop_offset": mi.ScalarPoint2u(crop[0], crop[1]),
+		"sensor.film.crop_size": mi.ScalarVector2u(crop[2], crop[3])
+	})
+
+	try:
+		yield
+	finally:
+		update_params(scene, {
+			"sensor.film.crop_offset": mi.ScalarPoint2u(x, y),
+			"sensor.film.crop_size": mi.ScalarVector2u(width, height)
+		})
+
+@contextmanager
+def moved_away(scene, shape_ids):
+	params = traverse(scene)
+
+	# Save old transforms
+	transforms = {f"{shape_id}.to_world": mi.Transform4f(params[f"{shape_id}.to_world"]) for shape_id in shape_ids}
+
+	# Move shapes away
+	update_params(scene, {key: mi.Transform4f().translate([0, 10000, 0]) for key in transforms.keys()})
 
-	return np.stack(images) # Dimensions: (N, 1, W, H, 3) or (N, 2, W, H, 3)
\ No newline at end of file
+	try:
+		yield
+	finally:
+		# Undo changes to scene
+		update_params(scene, transforms)
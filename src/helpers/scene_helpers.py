@@ -0,0 +1,67 @@
+import os
+import re
+import xml.etree.ElementTree as ET
+
+def scene_defaults(root) -> dict:
+	return {element.get("name"): element.get("value") for element in root.iter("default")}
+
+def substitute(value: str, args: dict) -> str:
+	return re.sub(r"\$(\w+)", lambda match: str(args.get(match.group(1), match.group(0))), value)
+
+def resolve_path(filename: str, search_paths: list[str]) -> str:
+	if os.path.isabs(filename):
+		return filename
+
+	for search_path in search_paths:
+		path = os.path.join(search_path, filename)
+
+		if os.path.exists(path):
+			return os.path.normpath(path)
+
+	return os.path.normpath(os.path.join(search_paths[0], filename))
+
+def scene_dependencies(scene_path: str, args: dict = {}, search_paths: list[str] = []) -> list[str]:
+	# Returns the scene file and all files it references (includes, meshes, textures, curves), similar to Mitsuba's file resolver
+	root = ET.parse(scene_path).getroot()
+	args = {**scene_defaults(root), **args}
+
+	scene_dir = os.path.dirname(os.path.abspath(scene_path))
+	search_paths = [scene_dir] + list(search_paths)
+
+	for element in root.iter("path"):
+		search_paths.insert(0, os.path.normpath(os.path.join(scene_dir, substitute(element.get("value"), args))))
+
+	files = [os.path.normpath(os.path.abspath(scene_path))]
+
+	for element in root.iter():
+		if element.tag == "include":
+			include_path = resolve_path(substitute(element.get("filename"), args), search_paths)
+			files += scene_dependencies(include_path, args, search_paths)
+		elif element.tag == "string" and element.get("name") == "filename":
+			files.append(resolve_path(substitute(element.get("value"), args), search_paths))
+
+	return files
+
+def flatten_scene(scene_path: str, args: dict = {}, search_paths: list[str] = []) -> ET.Element:
+	# Inlines all includes and replaces every filename by its absolute path, so the scene can be moved elsewhere
+	root = ET.parse(scene_path).getroot()
+	args = {**scene_defaults(root), **args}
+
+	scene_dir = os.path.dirname(os.path.abspath(scene_path))
+	search_paths = [scene_dir] + list(search_paths)
+
+	for element in root.findall("path"):
+		search_paths.insert(0, os.path.normpath(os.path.join(scene_dir, substitute(element.get("value"), args))))
+		root.remove(element)
+
+	for parent in list(root.iter()):
+		for index, element in reversed(list(enumerate(parent))):
+			if element.tag == "include":
+				include_path = resolve_path(substitute(element.get("filename"), args), search_paths)
+				included = [child for child in flatten_scene(include_path, args, search_paths) if child.tag != "default" or child.get("name") not in args]
+
+				parent[index:index + 1] = included
+			elif element.tag == "string" and element.get("name") == "filename" and "$" not in element.get("value"):
+				element.set("value", resolve_path(element.get("value"), search_paths))
+
+	return root
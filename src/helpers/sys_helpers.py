@@ -1,5 +1,14 @@
-import numpy as np
 import os
+os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1") # Has to be set before OpenCV reads or writes EXR files
+
+import numpy as np
+import skimage as ski
+import cv2
+import queue
+import threading
+
+# Linear float formats keep the rendered radiance, PNG is gamma encoded and quantized to 8 bit
+image_extensions = [".png", ".exr", ".npy"]
 
 def create_dir(path: str) -> bool:
 	if not os.path.exists(path):
@@ -23,7 +32,12 @@ def exec_cmd(cmd: str) -> None:
 
 	print()
 
+gamma_lut = (np.arange(256, dtype=float) / 255.0) ** 2.2
+
 def to_np_image(image):
+	if image.dtype == np.uint8:
+		return gamma_lut[image] # Same as below, but without the per pixel power
+
 	image = image.astype(float) / 255.0 # Convert to float range [0, 1]
 	image = image ** 2.2 # Gamma correction
 
@@ -36,4 +50,89 @@ def to_ski_image(image):
 	image = np.clip(image, 0, 1) # Clip again
 	image = np.uint8(image * 255.0) # Convert to integer range [0, 255]
 
-	return image
\ No newline at end of file
+	return image
+
+def save_image(path: str, image) -> None:
+	image = np.squeeze(image)
+	extension = os.path.splitext(path)[1]
+
+	if extension == ".exr":
+		image = image.astype(np.float32)
+
+		if image.ndim == 3:
+			image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+		cv2.imwrite(path, image, [cv2.IMWRITE_EXR_TYPE, cv2.IMWRITE_EXR_TYPE_HALF])
+	elif extension == ".npy":
+		np.save(path, image.astype(np.float16))
+	else:
+		ski.io.imsave(path, to_ski_image(image), check_contrast=False)
+
+def load_image(path: str, as_gray: bool = False):
+	# Returns the linear image as float array, regardless of the file format
+	extension = os.path.splitext(path)[1]
+
+	if extension == ".exr":
+		image = cv2.imread(path, cv2.IMREAD_UNCHANGED).astype(np.float32)
+
+		if image.ndim == 3:
+			image = cv2.cvtColor(image[..., :3], cv2.COLOR_BGR2RGB)
+	elif extension == ".npy":
+		image = np.load(path).astype(np.float32)
+	else:
+		image = to_np_image(ski.io.imread(path))
+
+	if as_gray and image.ndim == 3:
+		image = np.average(image[..., :3], axis=-1)
+
+	return image
+
+class ImageWriter:
+	"""
+	Writes images to disk on a background thread. At most `max_pending` images are
+	kept in memory, `write` blocks once the queue is full. Functions passed to `call`
+	run on the same thread after all previously queued images have been written.
+	"""
+
+	def __init__(self, max_pending: int = 8):
+		self.queue = queue.Queue(maxsize=max_pending)
+		self.error = None
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+
+	def _run(self) -> None:
+		while True:
+			item = self.queue.get()
+
+			if item is None:
+				break
+
+			fn, args = item
+
+			try:
+				if self.error is None:
+					fn(*args)
+			except Exception as e:
+				self.error = e
+
+	def call(self, fn, *args) -> None:
+		if self.error is not None:
+			raise self.error
+
+		self.queue.put((fn, args))
+
+	def write(self, path: str, image) -> None:
+		self.call(save_image, path, image)
+
+	def close(self) -> None:
+		self.queue.put(None)
+		self.thread.join()
+
+		if self.error is not None:
+			raise self.error
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
@@ -1,7 +1,6 @@
 import argparse
 import os
 from tqdm import tqdm
-import skimage as ski
 import shutil
 
 from pathlib import Path
@@ -45,22 +44,22 @@ def main():
 	for image in tqdm(images, desc="Writing", total=len(images)):
 		# gt
 		if args.gt == "":
-			global_img = to_np_image(ski.io.imread(os.path.join(gt_global, image)))
-			direct_img = to_np_image(ski.io.imread(os.path.join(gt_direct, image)))
+			global_img = load_image(os.path.join(gt_global, image))
+			direct_img = load_image(os.path.join(gt_direct, image))
 
 			combined = reconstruct(global_img, direct_img)
 
-			ski.io.imsave(os.path.join(gt_output, image), to_ski_image(combined), check_contrast=False)
+			save_image(os.path.join(gt_output, image), combined)
 		else:
 			shutil.copyfile(os.path.join(args.gt, image), os.path.join(gt_output, image))
 
 		# renders
-		global_img = to_np_image(ski.io.imread(os.path.join(renders_global, image)))
-		direct_img = to_np_image(ski.io.imread(os.path.join(renders_direct, image)))
+		global_img = load_image(os.path.join(renders_global, image))
+		direct_img = load_image(os.path.join(renders_direct, image))
 
 		combined = reconstruct(global_img, direct_img)
 
-		ski.io.imsave(os.path.join(renders_output, image), to_ski_image(combined), check_contrast=False)
+		save_image(os.path.join(renders_output, image), combined)
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
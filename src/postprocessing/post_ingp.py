@@ -9,7 +9,7 @@ import sys
 path_root = Path(__file__).parents[1]
 sys.path.append(str(path_root))
 
-from helpers.sys_helpers import to_np_image, to_ski_image, create_dir
+from helpers.sys_helpers import load_image, save_image, create_dir
 
 def mask_and_copy_renders(path, scene):
 	render_path = os.path.join(path, "results", scene, "test", "ours_30000", "renders")
@@ -19,14 +19,14 @@ def mask_and_copy_renders(path, scene):
 	assert os.path.exists(mask_path)
 
 	for i, img_name in enumerate(sorted(os.listdir(render_path))):
-		img = to_np_image(ski.io.imread(os.path.join(render_path, img_name)))
+		img = load_image(os.path.join(render_path, img_name))
 		
-		mask = to_np_image(ski.io.imread(os.path.join(mask_path, "dynamic_mask_" + img_name), as_gray=True))
+		mask = load_image(os.path.join(mask_path, "dynamic_mask_" + img_name), as_gray=True)
 		mask = 1.0 - mask
 		mask = ski.filters.gaussian(mask, sigma=3)
 
 		img[..., :3] *= mask[..., None]
-		ski.io.imsave(os.path.join(render_path, img_name), to_ski_image(img))
+		save_image(os.path.join(render_path, img_name), img)
 
 def copy_gt_images(path, scene):
 	image_path = os.path.join(path, scene, "images")
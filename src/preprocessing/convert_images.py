@@ -0,0 +1,40 @@
+import argparse
+import os
+
+from tqdm import tqdm
+
+from pathlib import Path
+import sys
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from helpers.sys_helpers import load_image, save_image, image_extensions
+
+def convert_images(image_path: str, extension: str, remove: bool) -> None:
+	files = sorted([file for file in os.listdir(image_path) if os.path.splitext(file)[1] in image_extensions and os.path.splitext(file)[1] != extension])
+
+	for file in tqdm(files, desc=f"Converting {image_path}", total=len(files)):
+		source = os.path.join(image_path, file)
+
+		save_image(os.path.join(image_path, os.path.splitext(file)[0] + extension), load_image(source))
+
+		if remove:
+			os.remove(source)
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Convert linear EXR/npy dataset images, e.g. to PNG for COLMAP and 3DGS.")
+	parser.add_argument("--source", "-s", type=str, required=True, help="Path to the dataset directory.")
+	parser.add_argument("--format", default="png", choices=["png", "exr", "npy"], type=str, required=False, help="Target image format.")
+	parser.add_argument("--remove", action="store_true", help="Remove the source images after conversion.")
+	args = parser.parse_args()
+
+	assert os.path.exists(args.source)
+
+	# Masks are always written as PNG
+	scenes = sorted([scene for scene in os.listdir(args.source) if os.path.isdir(os.path.join(args.source, scene, "images"))])
+
+	for scene in scenes:
+		convert_images(os.path.join(args.source, scene, "images"), "." + args.format, args.remove)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,35 @@
+import argparse
+import os
+import time
+import mitsuba as mi
+
+from pathlib import Path
+import sys
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from helpers.asset_helpers import AssetCache
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Convert the meshes, textures and curves of a scene into fast-loading files and write a scene XML using them.")
+	parser.add_argument("--scene", "-s", type=str, required=True)
+	parser.add_argument("--cache_dir", "-o", default="asset_cache", type=str, required=False, help="Directory of the converted assets and the rewritten scene XML.")
+	parser.add_argument("--variant", default="cuda_ad_spectral_polarized", type=str, required=False)
+	parser.add_argument("--test", action="store_true", help="Load the original and the precompiled scene and compare load times.")
+	args = parser.parse_args()
+
+	assert os.path.exists(args.scene)
+
+	mi.set_variant(args.variant)
+
+	scene_path = AssetCache(args.cache_dir).precompile(args.scene)
+	print(f"Precompiled scene: {scene_path}")
+
+	if args.test:
+		for path in [args.scene, scene_path]:
+			start = time.perf_counter()
+			mi.load_file(path)
+			print(f"Loaded {path} in {time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+	main()
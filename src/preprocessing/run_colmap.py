@@ -13,10 +13,31 @@ path_root = Path(__file__).parents[1]
 sys.path.append(str(path_root))
 
 from thirdparty.database import *
-from helpers.math_helpers import rotmat2qvec
+from helpers.math_helpers import rotmat2qvec_batch
 from helpers.sys_helpers import create_dir, exec_cmd, write_lines_to_file
 
-def extract_poses(calibration_file: str, output_path: str, include_test_cams: bool) -> None:
+def pose_pairs(view_matrices: np.ndarray, num_neighbors: int) -> list[tuple[int, int]]:
+	# Pairs of each view with its num_neighbors nearest views by angle between the viewing directions. On a
+	# sphere around the head, other views see disjoint sides, so the number of pairs grows linearly.
+	directions = view_matrices[:, 2, :3] # Camera z axis in world space (third row of the World-To-Camera rotation)
+	directions = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+	N = len(directions)
+	num_neighbors = min(num_neighbors, N - 1)
+
+	if num_neighbors <= 0:
+		return []
+
+	angles = np.arccos(np.clip(directions @ directions.T, -1, 1))
+	np.fill_diagonal(angles, np.inf)
+
+	neighbors = np.argpartition(angles, num_neighbors - 1, axis=1)[:, :num_neighbors]
+
+	pairs = {(min(i, j), max(i, j)) for i in range(N) for j in neighbors[i]}
+
+	return sorted(pairs)
+
+def extract_poses(calibration_file: str, output_path: str, include_test_cams: bool, num_neighbors: int = 0) -> None:
 	# Set camera model
 	camera_model = 1 # PINHOLE
 
@@ -36,14 +57,19 @@ def extract_poses(calibration_file: str, output_path: str, include_test_cams: bo
 	create_dir(sparse_path)
 	db_path = os.path.join(distorted_path, "database.db")
 
-	db = COLMAPDatabase.connect(db_path)
-	db.create_tables()
-
 	imagetxt_list = []
 	cameratxt_list = []
 	test_cams = []
 
-	print(f"Start writing to new database at '{db_path}'")
+	# View Matrices are given in World-To-Camera Space, the rotations of all cameras are converted at once
+	view_matrices = np.array([camera["extrinsics"]["view_matrix"] for camera in calibration["cameras"]], dtype=np.float64).reshape((-1, 4, 4))
+	qvecs = rotmat2qvec_batch(view_matrices[:, :3, :3])
+
+	# Cameras with identical intrinsics share one COLMAP camera
+	camera_ids = {}
+	camera_rows = []
+	image_rows = []
+	image_indices = []
 
 	for i, camera in tqdm(enumerate(calibration["cameras"]), desc="Reading camera calibration", total=len(calibration['cameras'])):
 		camera_name = camera["camera_id"]
@@ -56,15 +82,11 @@ def extract_poses(calibration_file: str, output_path: str, include_test_cams: bo
 			if not include_test_cams:
 				continue
 
-		# Extract pose information from the JSON file
-		view_matrix = np.array(camera["extrinsics"]["view_matrix"], dtype=np.float64).reshape((4, 4)) # View Matrix is given in World-To-Camera Space 
-
 		camera_matrix = np.array(camera["intrinsics"]["camera_matrix"], dtype=np.float64).reshape((3, 3))
 
 		# Camera rotation and translation
-		R = view_matrix[:3, :3]
-		T = view_matrix[:3, 3]
-		Q = rotmat2qvec(R)
+		T = view_matrices[i, :3, 3]
+		Q = qvecs[i]
 
 		# focal length
 		f_x = camera_matrix[0, 0]
@@ -78,26 +100,41 @@ def extract_poses(calibration_file: str, output_path: str, include_test_cams: bo
 		width = int(camera["intrinsics"]["resolution"][0])
 		height = int(camera["intrinsics"]["resolution"][1])
 
-		params = np.array([f_x, f_y, c_x, c_y])
+		params = (f_x, f_y, c_x, c_y)
+		intrinsics = (width, height) + params
+
+		if intrinsics not in camera_ids:
+			camera_id = len(camera_ids) + 1
+			camera_ids[intrinsics] = camera_id
+			camera_rows.append((camera_id, camera_model, width, height, params, False))
 
-		camera_id = db.add_camera(camera_model, width, height, params)
+			params_string = " ".join([str(num) for num in params])
+			cameratxt_list.append(f"{camera_id} PINHOLE {width} {height} {params_string}\n")
 
-		# image_id = db.add_image(image_name, camera_id, Q, T, image_id=i+1) # For COLMAP <= 3.9
-		image_id = db.add_image(image_name, camera_id, image_id=i+1) # For COLMAP >= 3.10
+		camera_id = camera_ids[intrinsics]
+		image_id = i + 1
 
-		db.commit()
+		# (image_id, image_name, camera_id, Q, T) for COLMAP <= 3.9
+		image_rows.append((image_id, image_name, camera_id)) # For COLMAP >= 3.10
+		image_indices.append(i)
 
-		# Append lines for images.txt and cameras.txt
+		# Append lines for images.txt
 		Q_string = " ".join([str(q) for q in Q])
 		T_string = " ".join([str(t) for t in T])
-		params_string = " ".join([str(num) for num in params])
 
-		image_line = f"{image_id} {Q_string} {T_string} {camera_id} {image_name}\n"
-		imagetxt_list.append(image_line)
+		imagetxt_list.append(f"{image_id} {Q_string} {T_string} {camera_id} {image_name}\n")
 		imagetxt_list.append("\n")
 
-		camera_line = f"{camera_id} PINHOLE {width} {height} {params_string}\n"
-		cameratxt_list.append(camera_line)
+	print(f"Start writing {len(image_rows)} images with {len(camera_rows)} shared camera(s) to new database at '{db_path}'")
+
+	db = COLMAPDatabase.connect(db_path)
+	db.set_bulk_pragmas()
+	db.create_tables()
+
+	# All rows are inserted in a single transaction
+	with db:
+		db.add_cameras(camera_rows)
+		db.add_images(image_rows)
 
 	db.close()
 
@@ -109,6 +146,14 @@ def extract_poses(calibration_file: str, output_path: str, include_test_cams: bo
 	write_lines_to_file([], os.path.join(manual_path, "points3D.txt"))
 	write_lines_to_file(test_cams, os.path.join(sparse_path, "test.txt"))
 
+	if num_neighbors > 0:
+		# Image pairs for matches_importer, so only views with overlapping content are matched
+		pairs = pose_pairs(view_matrices[image_indices], num_neighbors)
+		names = [row[1] for row in image_rows]
+
+		write_lines_to_file([f"{names[a]} {names[b]}\n" for a, b in pairs], os.path.join(distorted_path, "pairs.txt"))
+		print(f"Selected {len(pairs)} of {len(names) * (len(names) - 1) // 2} image pairs from the camera poses")
+
 	print("Done writing text output")
 	print()
 
@@ -134,10 +179,20 @@ def run_colmap(image_source: str, mask_source: str, output_path: str) -> None:
 		feature_extract += f" --ImageReader.mask_path {mask_source}"
 	exec_cmd(feature_extract)
 
-	feature_matcher = f"colmap exhaustive_matcher \
-		--database_path {db_path} \
-		--SiftMatching.guided_matching=true \
-		--SiftMatching.max_ratio=0.9" # --SiftMatching.guided_matching=true
+	pairs_path = os.path.join(distorted_path, "pairs.txt")
+
+	if os.path.exists(pairs_path):
+		feature_matcher = f"colmap matches_importer \
+			--database_path {db_path} \
+			--match_list_path {pairs_path} \
+			--match_type pairs \
+			--SiftMatching.guided_matching=true \
+			--SiftMatching.max_ratio=0.9"
+	else:
+		feature_matcher = f"colmap exhaustive_matcher \
+			--database_path {db_path} \
+			--SiftMatching.guided_matching=true \
+			--SiftMatching.max_ratio=0.9" # --SiftMatching.guided_matching=true
 	exec_cmd(feature_matcher)
 
 	tri_and_map = f"colmap point_triangulator \
@@ -172,7 +227,7 @@ def run_colmap(image_source: str, mask_source: str, output_path: str) -> None:
 		destination_file = os.path.join(sparse0, file)
 		shutil.move(source_file, destination_file)
 
-def reconstruct(image_path: str, output_path: str, calibration_path: str, mask_path: str, include_test_cams: bool) -> None:
+def reconstruct(image_path: str, output_path: str, calibration_path: str, mask_path: str, include_test_cams: bool, num_neighbors: int = 0) -> None:
 	if os.path.exists(output_path):
 		print(f"Removing old reconstruction for {output_path}")
 		shutil.rmtree(output_path)
@@ -180,7 +235,7 @@ def reconstruct(image_path: str, output_path: str, calibration_path: str, mask_p
 	print(f"Starting reconstruction for {image_path}...")
 	print()
 
-	extract_poses(calibration_path, output_path, include_test_cams)
+	extract_poses(calibration_path, output_path, include_test_cams, num_neighbors)
 	run_colmap(image_path, mask_path, output_path)
 
 
@@ -191,6 +246,7 @@ def main() -> None:
 	parser.add_argument("--calibration_path", "-c", default="", type=str, required=False, help="Path to the calibration file (default: SOURCE/poses.json).")
 	parser.add_argument("--mask_path", "-m", default="", type=str, required=False, help="Path to the alpha masks. If no path is passed, the program will look in SOURCE/masks.")
 	parser.add_argument("--include_test_cams", action="store_true", help="Include test cameras in the reconstruction.")
+	parser.add_argument("--neighbors", default=20, type=int, required=False, help="Match each image only with the images of the N closest camera directions (0: match all pairs).")
 	args = parser.parse_args()
 
 	# Make sure image input exists
@@ -219,7 +275,7 @@ def main() -> None:
 
 	# Run COLMAP reconstruction for all scenes
 	for scene_src, scene_dst in zip(scene_sources, scene_outputs):
-		reconstruct(scene_src, scene_dst, args.calibration_path, args.mask_path, args.include_test_cams)
+		reconstruct(scene_src, scene_dst, args.calibration_path, args.mask_path, args.include_test_cams, args.neighbors)
 
 if __name__ == "__main__":
 	main()
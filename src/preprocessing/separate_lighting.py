@@ -1,7 +1,6 @@
 import argparse
 import os
 
-import skimage as ski
 from tqdm import tqdm
 
 from pathlib import Path
@@ -10,9 +9,9 @@ path_root = Path(__file__).parents[1]
 sys.path.append(str(path_root))
 
 from helpers.polarization_helpers import separate
-from helpers.sys_helpers import create_dir, to_np_image, to_ski_image
+from helpers.sys_helpers import create_dir, load_image, save_image
 
-def separate_images(source_path: str, direct_path: str, global_path: str) -> None:
+def separate_images(source_path: str, direct_path: str, global_path: str, extension: str = "") -> None:
 	polarized_0_path = os.path.join(source_path, "polarized_0", "images")
 	polarized_90_path = os.path.join(source_path, "polarized_90", "images")
 	assert os.path.exists(polarized_0_path) and os.path.exists(polarized_90_path)
@@ -22,19 +21,24 @@ def separate_images(source_path: str, direct_path: str, global_path: str) -> Non
 			print(f"Image names do not match: {img_0_name} and {img_90_name}. Skipping these images.")
 			continue
 
-		img_0 = to_np_image(ski.io.imread(os.path.join(polarized_0_path, img_0_name)))
-		img_90 = to_np_image(ski.io.imread(os.path.join(polarized_90_path, img_90_name)))
+		# Linear EXR/npy images are read without any decoding or gamma correction
+		img_0 = load_image(os.path.join(polarized_0_path, img_0_name))
+		img_90 = load_image(os.path.join(polarized_90_path, img_90_name))
 
 		global_img, direct_img = separate(img_0, img_90)
 
-		ski.io.imsave(os.path.join(global_path, img_0_name), to_ski_image(global_img), check_contrast=False)
-		ski.io.imsave(os.path.join(direct_path, img_0_name), to_ski_image(direct_img), check_contrast=False)
+		name, img_extension = os.path.splitext(img_0_name)
+		output_name = name + (extension if extension != "" else img_extension)
+
+		save_image(os.path.join(global_path, output_name), global_img)
+		save_image(os.path.join(direct_path, output_name), direct_img)
 
 def main() -> None:
 	parser = argparse.ArgumentParser(description="Separate lighting into global and direct components.")
 	parser.add_argument("--source", "-s", default="", type=str, required=True, help="Path to the source directory containing the polarized images.")
 	parser.add_argument("--output", "-o", default="", type=str, required=False, help="Path to the output directory where the separated images will be saved (default: SOURCE).")
 	parser.add_argument("--overwrite", action="store_true", help="Overwrite existing images.")
+	parser.add_argument("--format", default="", choices=["", "png", "exr", "npy"], type=str, required=False, help="Output image format (default: same as the polarized images).")
 	args = parser.parse_args()
 
 	if args.output == "":
@@ -50,7 +54,7 @@ def main() -> None:
 		print(f"Separated images already exist in {args.output}. Use --overwrite to overwrite them.")
 		return
 
-	separate_images(args.source, direct_path, global_path)
+	separate_images(args.source, direct_path, global_path, "." + args.format if args.format != "" else "")
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
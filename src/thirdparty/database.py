@@ -207,6 +207,33 @@ class COLMAPDatabase(sqlite3.Connection):
         )
         return cursor.lastrowid
 
+    def set_bulk_pragmas(self):
+        # Faster bulk inserts, at the cost of durability on crashes (the database is
+        # recreated from the calibration file anyway)
+        self.execute("PRAGMA journal_mode=WAL")
+        self.execute("PRAGMA synchronous=OFF")
+
+    def add_cameras(self, cameras):
+        # cameras: iterable of (camera_id, model, width, height, params, prior_focal_length)
+        self.executemany(
+            "INSERT INTO cameras VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    camera_id,
+                    model,
+                    width,
+                    height,
+                    array_to_blob(np.asarray(params, np.float64)),
+                    prior_focal_length,
+                )
+                for camera_id, model, width, height, params, prior_focal_length in cameras
+            ],
+        )
+
+    def add_images(self, images):
+        # images: iterable of (image_id, name, camera_id)
+        self.executemany("INSERT INTO images VALUES (?, ?, ?)", list(images))
+
     def add_pose_prior(
         self, image_id, position, coordinate_system=-1, position_covariance=None
     ):
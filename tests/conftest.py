@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import the helpers relative to src
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
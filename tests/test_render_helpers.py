@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("mitsuba")
+
+from helpers.math_helpers import fov_to_focal
+from helpers.render_helpers import primary_ray_directions
+
+def test_primary_ray_directions_non_square():
+	# Projecting the rays of a non-square film with the pinhole intrinsics must give back the pixel centers
+	width, height, x_fov = 64, 24, 40
+	directions = primary_ray_directions(width, height, x_fov)[:, :, 0]
+
+	focal_length = fov_to_focal(x_fov, width)
+
+	# +x points left and +y up in camera space, while pixel coordinates grow to the right and down
+	u = width / 2 - focal_length * directions[..., 0] / directions[..., 2]
+	v = height / 2 - focal_length * directions[..., 1] / directions[..., 2]
+
+	rows, cols = np.mgrid[0:height, 0:width] + 0.5
+
+	assert np.allclose(u, cols, atol=1e-3)
+	assert np.allclose(v, rows, atol=1e-3)
+
+def polarized_test_scene():
+	import mitsuba as mi
+
+	variant = next((variant for variant in ["llvm_ad_spectral_polarized", "scalar_spectral_polarized"] if variant in mi.variants()), None)
+
+	if variant is None:
+		pytest.skip("No polarized Mitsuba variant")
+
+	mi.set_variant(variant)
+
+	return mi.load_dict({
+		"type": "scene",
+		"integrator": {"type": "path", "max_depth": 4},
+		"sensor": {
+			"type": "perspective",
+			"fov": 30,
+			"to_world": mi.ScalarTransform4f().look_at(origin=[0, 0, 5], target=[0, 0, 0], up=[0, 1, 0]),
+			"film": {"type": "hdrfilm", "width": 24, "height": 16},
+			"sampler": {"type": "independent", "sample_count": 16}
+		},
+		"sphere": {"type": "sphere", "bsdf": {"type": "pplastic"}},
+		"light": {"type": "point", "position": [3, 4, 5], "intensity": {"type": "uniform", "value": 100}},
+		"polarizer_cam": {"type": "rectangle", "bsdf": {"type": "polarizer"}}
+	})
+
+def test_batched_stokes_matches_single_view():
+	from helpers.render_helpers import render_from_angle, render_from_angles
+
+	scene = polarized_test_scene()
+	angles = (0, 45, 90)
+	thetas, phis = np.array([0.3 * np.pi, 0.6 * np.pi]), np.array([0.2 * np.pi, 1.3 * np.pi])
+
+	# Leaves the scene's sensor at a pose that differs from both batched views
+	render_from_angle(scene, 5, 0.5 * np.pi, 0.7 * np.pi, spp=1, angles=angles, stokes=True)
+	batched = render_from_angles(scene, 5, thetas, phis, spp=1024, angles=angles, stokes=True, batch_size=2)
+
+	for k in range(len(thetas)):
+		single = render_from_angle(scene, 5, thetas[k], phis[k], spp=1024, angles=angles, stokes=True)
+
+		# The analyzer images only agree if the Stokes vectors are in the same frame
+		assert np.abs(batched[k] - single).mean() < 0.05 * np.abs(single).mean()
+		assert np.abs((batched[k][0] - batched[k][2]) - (single[0] - single[2])).mean() < 0.1 * np.abs(single[0] - single[2]).mean() + 1e-4